@@ -7,14 +7,15 @@ import dash_bootstrap_components as dbc
 import dtlpy as dl
 
 import uvicorn
-from exporter import Exporter
-from dash import Dash, Input, Output, callback, dcc, html
+from exporter import GRAPH_ROWS, UNAVAILABLE_FIGURE, Exporter, build_scheduler, dashboard_cache, schedule_export
+from utils.status_registry import status_registry
+from dash import Dash, Input, Output, State, callback, dcc, html
 from dash_bootstrap_templates import load_figure_template
 
-from fastapi import BackgroundTasks, FastAPI
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.wsgi import WSGIMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
 
@@ -24,6 +25,14 @@ logging.basicConfig(level='INFO')
 load_figure_template(["cyborg", "darkly", "minty", "cerulean"])
 
 port = 3000
+# longest a status long-poll request is held, in seconds
+MAX_STATUS_WAIT = 30
+# seconds between two keep-alive comments of an idle event stream
+EVENTS_KEEPALIVE = 15
+# milliseconds the browser waits before reconnecting a dropped event stream
+EVENTS_RETRY = 2000
+# most labels of a /labels page
+MAX_LABELS_PAGE = 1000
 
 app = FastAPI()
 
@@ -54,6 +63,90 @@ app_dash.layout = html.Div(
 )
 
 
+# each graph fetches its serialized figure from the URL in its store, as the server saved it, once it is
+# scrolled into view: the graphs in view load in parallel, and the ones nobody scrolls to are never fetched.
+# A figure that can not be fetched (e.g. while a rebuild runs) says so instead of loading forever.
+for _row in GRAPH_ROWS:
+    for _graph_id, _ in _row:
+        app_dash.clientside_callback(
+            """
+            async function(url, graphId) {
+                if (!url) {
+                    return window.dash_clientside.no_update;
+                }
+                const graph = document.getElementById(graphId);
+                if (graph && 'IntersectionObserver' in window) {
+                    await new Promise((resolve) => {
+                        const observer = new IntersectionObserver((entries) => {
+                            if (entries.some((entry) => entry.isIntersecting)) {
+                                observer.disconnect();
+                                resolve();
+                            }
+                        }, {rootMargin: '200px'});
+                        observer.observe(graph);
+                    });
+                }
+                const response = await fetch(url);
+                if (!response.ok) {
+                    return %s;
+                }
+                return await response.json();
+            }
+            """ % json.dumps(UNAVAILABLE_FIGURE),
+            Output(_graph_id, 'figure'),
+            Input(f'{_graph_id}-src', 'data'),
+            State(_graph_id, 'id'),
+        )
+
+
+# clicking the "other" bar of the labels histogram (or the bar of the labels before a page) shows the page of
+# label counts at the offset in its customdata, from /labels, with the labels before and after it as single bars
+for _row in GRAPH_ROWS:
+    for _graph_id, _method in _row:
+        if _method != 'bar_annotations_labels':
+            continue
+        app_dash.clientside_callback(
+            """
+            async function(clickData, url, figure) {
+                const point = clickData && clickData.points[0];
+                if (!point || point.customdata === null || point.customdata === undefined || !url || !figure) {
+                    return window.dash_clientside.no_update;
+                }
+                const labelsUrl = url.replace(/\\/figures\\/([^/]+)\\/.*/, '/labels/$1');
+                const response = await fetch(`${labelsUrl}?offset=${point.customdata}`);
+                if (!response.ok) {
+                    return window.dash_clientside.no_update;
+                }
+                const page = await response.json();
+                const x = [], y = [], customdata = [];
+                if (page.offset > 0) {
+                    x.push(`top ${page.offset.toLocaleString()} labels`);
+                    y.push(page.before);
+                    customdata.push(Math.max(0, page.offset - page.limit));
+                }
+                page.labels.forEach((label, i) => {
+                    x.push(label);
+                    y.push(page.counts[i]);
+                    customdata.push(null);
+                });
+                const after = page.total - page.offset - page.labels.length;
+                if (after > 0) {
+                    x.push(`other (${after.toLocaleString()} labels)`);
+                    y.push(page.after);
+                    customdata.push(page.offset + page.labels.length);
+                }
+                const trace = {...figure.data[0], x, y, customdata};
+                return {...figure, data: [trace]};
+            }
+            """,
+            Output(_graph_id, 'figure', allow_duplicate=True),
+            Input(_graph_id, 'clickData'),
+            State(f'{_graph_id}-src', 'data'),
+            State(_graph_id, 'figure'),
+            prevent_initial_call=True,
+        )
+
+
 @callback(
     Output('main-container', 'children'),
     [Input('url', 'pathname'), Input('url', 'search')],
@@ -81,7 +174,7 @@ def display_page(pathname, search):
                 exporter = Exporter(dataset_id=dataset_id)
                 content = html.Div(
                     className=['scroll', 'reactive-scroll'],
-                    children=[dcc.Location(id='plots'), *exporter.divs],
+                    children=[dcc.Location(id='plots'), *exporter.get_dashboard()],
                 )
             except Exception as e:
                 logger.exception('failed to create exporter: %s', e)
@@ -120,61 +213,207 @@ class Runner(dl.BaseServiceRunner):
         self.thread.start()
 
 
+async def get_state(dataset_id, since, wait):
+    """
+    Reads the dataset state from the status registry, waiting up to `wait` seconds for a version newer
+    than `since` when both are given (long-poll).
+    """
+    if since is not None and wait > 0:
+        return await status_registry.wait(dataset_id, since=since, timeout=min(wait, MAX_STATUS_WAIT))
+    return status_registry.get(dataset_id)
+
+
+def export_fields(state):
+    """
+    Returns the export fields of a dataset state, as served by `/export/status`.
+    """
+    return {
+        'progress': int(state.get('exportProgress') or 0),
+        'exportDate': state.get('exportDate'),
+        'status': state.get('exportStatus'),
+    }
+
+
+def build_fields(state):
+    """
+    Returns the build fields of a dataset state, as served by `/build/status`.
+    """
+    return {
+        'status': state.get('buildStatus'),
+        'progress': state.get('buildProgress'),
+        'itemsProcessed': state.get('itemsProcessed'),
+        'itemsTotal': state.get('itemsTotal'),
+        'rate': state.get('buildRate'),
+        'eta': state.get('buildEta'),
+        'error': state.get('buildError'),
+        'approximate': bool(state.get('dashboardApproximate')),
+    }
+
+
 @app.get("/export/status")
-async def export_status(datasetId: str):
+async def export_status(datasetId: str, since: int = None, wait: float = 0):
     """
     Get the export status for a specific dataset.
 
     Parameters:
     - datasetId (str): The ID of the dataset.
+    - since (int): Optional state version the client already has, to long-poll for the next one.
+    - wait (float): Seconds to wait for a newer state than `since` (at most 30).
 
     Returns:
-    - JSON response with export status, progress, export date, and export item ID.
+    - JSON response with export status, progress, export date and state version,
+      or an empty object if the dataset has no state yet.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    status = {
-        'progress': int(exporter.progress),
-        'exportDate': exporter.last_update,
-        'status': exporter.status.value,
-    }
+    state = await get_state(dataset_id=datasetId, since=since, wait=wait)
+    status = dict()
+    if state is not None:
+        status = {**export_fields(state), 'version': state['version']}
     logger.info("Returning status: %s", status)
     return HTMLResponse(json.dumps(status, indent=2), status_code=200)
 
 
 @app.get("/export/run")
-async def export_run(datasetId: str, cache: str, background_tasks: BackgroundTasks):
+def export_run(datasetId: str, cache: str):
     """
     Start the export process for a specific dataset.
 
+    The export and build is queued on the build scheduler, which runs it in a build worker
+    process. If the dataset already has one queued or running, the request attaches to it
+    instead of starting another one. Scheduling constructs the exporter (with SDK requests), so
+    this handler runs in the threadpool rather than on the event loop.
+
     Parameters:
     - datasetId (str): The ID of the dataset.
+    - cache (str): Whether to reuse the cached export ('yes') or not ('no').
 
     Returns:
-    - JSON response indicating that the export has started.
+    - JSON response indicating that the export has started, or was already running.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    exporter.progress = 0
-    background_tasks.add_task(exporter.check_and_run, use_cache=cache)
-    return HTMLResponse(json.dumps({'status': 'started'}), status_code=200)
+    created = schedule_export(dataset_id=datasetId, use_cache=cache)
+    status = 'started' if created else 'running'
+    return HTMLResponse(json.dumps({'status': status}), status_code=200)
 
 
 @app.get("/build/status")
-def build_status(datasetId):
+async def build_status(datasetId: str, since: int = None, wait: float = 0):
     """
     Get the build status for insights of a specific dataset.
 
     Parameters:
     - datasetId (str): The ID of the dataset.
+    - since (int): Optional state version the client already has, to long-poll for the next one.
+    - wait (float): Seconds to wait for a newer state than `since` (at most 30).
 
     Returns:
-    - JSON response with the build status.
+    - JSON response with the build status, progress, items processed, rate, ETA, error,
+      whether the current dashboard is approximate (while the exact build runs) and state
+      version, or an empty object if the dataset has no state yet.
+    """
+    state = await get_state(dataset_id=datasetId, since=since, wait=wait)
+    status = dict()
+    if state is not None:
+        status = {**build_fields(state), 'version': state['version']}
+    logger.info("Returning status: %s", status)
+    return HTMLResponse(json.dumps(status, indent=2), status_code=200)
+
+
+@app.get("/build/events")
+async def build_events(datasetId: str, last_event_id: int = Header(None)):
+    """
+    Stream the export and build progress of a specific dataset as Server-Sent Events.
+
+    Every state change is sent as a `progress` event, with the build fields of `/build/status`
+    (the build status as `phase`) and the `/export/status` fields under `export`. The event id is
+    the state version, so a reconnecting browser only gets the states it missed.
+
+    Parameters:
+    - datasetId (str): The ID of the dataset.
+
+    Returns:
+    - text/event-stream response.
+    """
+
+    async def stream():
+        version = last_event_id or 0
+        yield f'retry: {EVENTS_RETRY}\n\n'
+        while True:
+            state = await status_registry.wait(datasetId, since=version, timeout=EVENTS_KEEPALIVE)
+            if state is None or state['version'] == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = state['version']
+            event = build_fields(state)
+            event['phase'] = event.pop('status')
+            event['export'] = export_fields(state)
+            yield f'id: {version}\nevent: progress\ndata: {json.dumps(event)}\n\n'
+
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.get("/figures/{dataset_id}/{graph_id}")
+def figure(dataset_id: str, graph_id: str):
+    """
+    Get a serialized figure of the insights of a specific dataset.
+
+    Parameters:
+    - dataset_id (str): The ID of the dataset.
+    - graph_id (str): The ID of the graph.
+
+    Returns:
+    - The figure JSON, gzip-encoded as it was saved at build time.
+    """
+    exporter: Exporter = Exporter(dataset_id=dataset_id)
+    content = exporter.get_figure(graph_id=graph_id)
+    if content is None:
+        return HTMLResponse(json.dumps({'error': 'figure not found'}), status_code=404)
+    return Response(
+        content=content,
+        media_type='application/json',
+        headers={'Content-Encoding': 'gzip', 'Cache-Control': 'private, max-age=86400'},
+    )
+
+
+@app.get("/labels/{dataset_id}")
+def labels(dataset_id: str, offset: int = 0, limit: int = None):
+    """
+    Get a page of the label counts of the insights of a specific dataset, most frequent first.
+
+    Parameters:
+    - dataset_id (str): The ID of the dataset.
+    - offset (int): Labels to skip.
+    - limit (int): Labels of the page (at most 1000), by default as many as the labels histogram shows.
+
+    Returns:
+    - JSON response with the page labels and counts, its offset and limit, the total number of labels,
+      and the summed counts of the labels before and after the page.
+    """
+    exporter: Exporter = Exporter(dataset_id=dataset_id)
+    if limit is None:
+        limit = exporter.settings['labels_top_k']
+    limit = max(1, min(limit, MAX_LABELS_PAGE))
+    page = exporter.get_label_counts(offset=max(0, offset), limit=limit)
+    if page is None:
+        return HTMLResponse(json.dumps({'error': 'label counts not found'}), status_code=404)
+    return HTMLResponse(json.dumps({**page, 'limit': limit}), status_code=200)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Get the process metrics of the insights server.
+
+    Returns:
+    - JSON response with the dashboard cache entries, size, hits, misses and evictions,
+      and the build scheduler queued and running jobs.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
     status = {
-        'status': exporter.build_status,
-        'progress': exporter.build_progress,
+        'dashboardCache': dashboard_cache.metrics(),
+        'buildScheduler': build_scheduler.metrics(),
     }
-    logger.info("Returning status: %s", status)
     return HTMLResponse(json.dumps(status, indent=2), status_code=200)
 
 
@@ -0,0 +1,269 @@
+"""
+Benchmarks the insights build stages on synthetic exports, offline.
+
+Every stage (export to tables, parquet write and read, aggregates, each chart and the whole dashboard) is
+timed and memory-profiled at each scale, and the results are written as JSON, e.g.:
+
+    python -m benchmarks.run --scales 1000 10000 100000 --baseline benchmarks/results/<earlier run>.json
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import GEOMETRY_TYPES, synthetic_download_data
+from utils.aggregates import InsightsAggregates
+from utils.approximate import approximate_aggregates
+from utils.config import load_settings
+from utils.figure_store import serialize_figure
+from utils.generate_graphs import GraphsCalculator
+from utils.insights_tables import InsightsTableHandle, build_tables, read_insights_table, write_insights_table
+from utils.memory import peak_rss_mb
+
+logger = logging.getLogger('[INSIGHTS BENCHMARK]')
+
+# version of the results layout
+RESULTS_VERSION = 1
+DEFAULT_SCALES = (1000, 10000, 100000)
+DEFAULT_OUTPUT_DIR = os.path.join('benchmarks', 'results')
+# GraphsCalculator methods of the dashboard charts, as laid out in `exporter.GRAPH_ROWS`
+CHARTS = (
+    'histogram_annotation_by_item',
+    'pie_annotation_type',
+    'bar_annotations_labels',
+    'scatter_item_height_width',
+    'heatmap_annotation_location',
+    'scatter_annotation_height_width',
+)
+
+
+def measure(stage, fn, repeat=1, trace_memory=True):
+    """
+    Runs a benchmark stage `repeat` times to time it, then once more under tracemalloc for its memory peak,
+    as tracing slows Python allocations down.
+
+    Args:
+        stage (str): stage name.
+        fn (callable): the stage, without arguments.
+        repeat (int): timed runs.
+        trace_memory (bool): measure the memory peak.
+
+    Returns:
+        tuple: (result of the last run, record), the record holding the `stage`, its fastest run `seconds`,
+        all the run `times`, the `peak_mb` allocated during the stage and the process peak `rss_mb`.
+    """
+    times = list()
+    result = None
+    for _ in range(max(1, repeat)):
+        result = None
+        t = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t)
+    record = {'stage': stage, 'seconds': min(times), 'times': times}
+    if trace_memory:
+        result = None
+        tracemalloc.start()
+        try:
+            result = fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        record['peak_mb'] = peak / 1024 ** 2
+    record['rss_mb'] = peak_rss_mb()
+    return result, record
+
+
+def _render_chart(method, aggregates, settings):
+    return serialize_figure(getattr(GraphsCalculator(), method)(aggregates=aggregates, settings=settings))
+
+
+def _render_dashboard(aggregates, settings):
+    # all the charts at once, as `Exporter.create_figures` renders them
+    gc = GraphsCalculator()
+    with ThreadPoolExecutor(max_workers=max(1, settings['figure_workers'])) as pool:
+        return list(pool.map(
+            lambda method: serialize_figure(getattr(gc, method)(aggregates=aggregates, settings=settings)),
+            CHARTS))
+
+
+def _write_tables(items_df, annotations_df, items_path, annotations_path):
+    write_insights_table(df=items_df, path=items_path, table_name='items')
+    write_insights_table(df=annotations_df, path=annotations_path, table_name='annotations')
+
+
+def _read_tables(items_path, annotations_path):
+    return read_insights_table(items_path)[0], read_insights_table(annotations_path)[0]
+
+
+def run_scale(num_items, args, settings):
+    """
+    Benchmarks every stage on a synthetic export of `num_items` items.
+
+    Args:
+        num_items (int): items of the export.
+        args (argparse.Namespace): the benchmark options.
+        settings (dict): insights settings.
+
+    Returns:
+        dict: the export sizes and the stage records, see `measure`.
+    """
+    records = list()
+
+    def stage(name, fn, **kwargs):
+        result, record = measure(stage=name,
+                                 fn=functools.partial(fn, **kwargs),
+                                 repeat=args.repeat,
+                                 trace_memory=not args.no_memory)
+        records.append(record)
+        logger.info('%d items, %s: %.3f[s], peak %.1f[MB]',
+                    num_items, name, record['seconds'], record.get('peak_mb', float('nan')))
+        return result
+
+    download_data = stage('generate',
+                          synthetic_download_data,
+                          num_items=num_items,
+                          annotations_per_item=args.annotations_per_item,
+                          num_labels=args.labels,
+                          geometry_types=tuple(args.types),
+                          seed=args.seed)
+    items_df, annotations_df = stage('build_tables',
+                                     build_tables,
+                                     download_data=download_data,
+                                     max_workers=settings['build_workers'],
+                                     chunk_size=settings['build_chunk_size'])
+    with tempfile.TemporaryDirectory() as local_dir:
+        items_path = os.path.join(local_dir, 'items.parquet')
+        annotations_path = os.path.join(local_dir, 'annotations.parquet')
+        stage('parquet_write',
+              _write_tables,
+              items_df=items_df,
+              annotations_df=annotations_df,
+              items_path=items_path,
+              annotations_path=annotations_path)
+        records[-1]['bytes'] = os.path.getsize(items_path) + os.path.getsize(annotations_path)
+        stage('parquet_read', _read_tables, items_path=items_path, annotations_path=annotations_path)
+        stage('aggregates_from_handles',
+              InsightsAggregates.from_handles,
+              items=InsightsTableHandle(items_path),
+              annotations=InsightsTableHandle(annotations_path),
+              settings=settings)
+    aggregates = stage('aggregates_from_tables',
+                       InsightsAggregates.from_tables,
+                       items_df=items_df,
+                       annotations_df=annotations_df,
+                       settings=settings)
+    stage('approximate_aggregates',
+          approximate_aggregates,
+          download_data=download_data,
+          settings=settings,
+          sample_size=settings['approximate_sample_items'],
+          seed=args.seed)
+    for method in CHARTS:
+        content = stage(f'chart:{method}', _render_chart, method=method, aggregates=aggregates, settings=settings)
+        records[-1]['bytes'] = len(content)
+    contents = stage('dashboard', _render_dashboard, aggregates=aggregates, settings=settings)
+    records[-1]['bytes'] = sum(len(content) for content in contents)
+    return {
+        'items': len(items_df),
+        'annotations': len(annotations_df),
+        'labels': int(annotations_df['label'].nunique()),
+        'stages': records,
+    }
+
+
+def compare(results, baseline):
+    """
+    Compares the stage times of two benchmark results, at the scales and stages both have.
+
+    Args:
+        results (dict): benchmark results.
+        baseline (dict): earlier benchmark results.
+
+    Returns:
+        list: (items, stage, baseline seconds, seconds, ratio) rows.
+    """
+    baseline_seconds = {(run['config']['num_items'], record['stage']): record['seconds']
+                        for run in baseline['runs'] for record in run['stages']}
+    rows = list()
+    for run in results['runs']:
+        for record in run['stages']:
+            before = baseline_seconds.get((run['config']['num_items'], record['stage']))
+            if before:
+                rows.append((run['config']['num_items'], record['stage'], before, record['seconds'],
+                             record['seconds'] / before))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the insights build stages on synthetic exports.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES),
+                        help='numbers of items of the synthetic exports')
+    parser.add_argument('--annotations-per-item', type=float, default=10,
+                        help='average number of annotations of an item')
+    parser.add_argument('--labels', type=int, default=100, help='number of distinct labels')
+    parser.add_argument('--types', nargs='+', default=list(GEOMETRY_TYPES), choices=GEOMETRY_TYPES,
+                        help='annotation geometry types')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic exports')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs of each stage, the fastest is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the memory profiling runs')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_DIR, help='directory of the results JSON')
+    parser.add_argument('--baseline', default=None, help='results JSON of an earlier run to compare with')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Runs the benchmark at every scale and writes the results to `<output>/benchmark-<UTC time>.json`.
+
+    Returns:
+        str: path of the results.
+    """
+    logging.basicConfig(level='INFO')
+    args = parse_args(argv)
+    settings = load_settings()
+    started = datetime.now(timezone.utc)
+    results = {
+        'version': RESULTS_VERSION,
+        'started': started.isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': settings,
+        'runs': list(),
+    }
+    for num_items in args.scales:
+        run = run_scale(num_items=num_items, args=args, settings=settings)
+        run['config'] = {
+            'num_items': num_items,
+            'annotations_per_item': args.annotations_per_item,
+            'num_labels': args.labels,
+            'types': list(args.types),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        }
+        results['runs'].append(run)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f'benchmark-{started.strftime("%Y%m%dT%H%M%SZ")}.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info('results: %s', path)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for items, stage, before, seconds, ratio in compare(results=results, baseline=baseline):
+            logger.info('%d items, %s: %.3f[s] -> %.3f[s] (x%.2f)', items, stage, before, seconds, ratio)
+    return path
+
+
+if __name__ == '__main__':
+    main()
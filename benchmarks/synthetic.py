@@ -0,0 +1,89 @@
+import random
+
+# geometry types of the synthetic annotations. 'class' has no coordinates and goes through the SDK when the
+# tables are built, like the annotation types `utils.annotation_bounds` does not read.
+GEOMETRY_TYPES = ('box', 'segment', 'polyline', 'point', 'ellipse', 'class')
+# (width, height) of the synthetic items
+IMAGE_SIZES = ((640, 480), (1280, 720), (1920, 1080), (1024, 1024), (4000, 3000))
+MIMETYPES = ('image/jpeg', 'image/png')
+# vertices of the synthetic segments and polylines
+POLYGON_POINTS = 8
+
+
+def _coordinates(rng, annotation_type, width, height):
+    x1, y1 = rng.uniform(0, width * 0.9), rng.uniform(0, height * 0.9)
+    x2, y2 = rng.uniform(x1, width), rng.uniform(y1, height)
+    if annotation_type == 'box':
+        return [{'x': x1, 'y': y1, 'z': 0}, {'x': x2, 'y': y2, 'z': 0}]
+    if annotation_type in ('segment', 'polyline'):
+        return [[{'x': rng.uniform(x1, x2), 'y': rng.uniform(y1, y2), 'z': 0} for _ in range(POLYGON_POINTS)]]
+    if annotation_type == 'point':
+        return {'x': x1, 'y': y1, 'z': 0}
+    if annotation_type == 'ellipse':
+        return {'center': {'x': (x1 + x2) / 2, 'y': (y1 + y2) / 2},
+                'rx': (x2 - x1) / 2,
+                'ry': (y2 - y1) / 2,
+                'angle': rng.uniform(0, 180)}
+    return list()
+
+
+def synthetic_download_data(num_items,
+                            annotations_per_item=10,
+                            num_labels=100,
+                            geometry_types=GEOMETRY_TYPES,
+                            image_sizes=IMAGE_SIZES,
+                            seed=0):
+    """
+    Generates an export like the one `ExportBase` downloads, offline: item JSONs with their 'annotations'.
+
+    Items get a random size of `image_sizes`, and between 0 and twice `annotations_per_item` annotations.
+    Labels follow a Zipf-like distribution (label i is about i times rarer than the first one), so that a
+    few labels are frequent and most are rare, as in real ontologies.
+
+    Args:
+        num_items (int): number of items.
+        annotations_per_item (float): average number of annotations of an item.
+        num_labels (int): number of distinct labels.
+        geometry_types (tuple): annotation types, equally frequent, from `GEOMETRY_TYPES`.
+        image_sizes (tuple): (width, height) of the items.
+        seed (int): random seed, the same one generates the same export.
+
+    Returns:
+        list: exported item JSONs.
+    """
+    rng = random.Random(seed)
+    labels = [f'label-{i_label}' for i_label in range(num_labels)]
+    label_weights = [1 / (i_label + 1) for i_label in range(num_labels)]
+    max_annotations = int(round(2 * annotations_per_item))
+    download_data = list()
+    for i_item in range(num_items):
+        item_id = f'item-{i_item}'
+        width, height = rng.choice(image_sizes)
+        num_annotations = rng.randint(0, max_annotations)
+        item_labels = rng.choices(labels, weights=label_weights, k=num_annotations)
+        annotations = list()
+        for i_annotation, label in enumerate(item_labels):
+            annotation_type = rng.choice(geometry_types)
+            annotations.append({
+                'id': f'{item_id}-annotation-{i_annotation}',
+                'itemId': item_id,
+                'datasetId': 'synthetic',
+                'type': annotation_type,
+                'label': label,
+                'attributes': list(),
+                'coordinates': _coordinates(rng=rng, annotation_type=annotation_type, width=width, height=height),
+                'metadata': {'system': dict()},
+                'creator': 'benchmark',
+                'createdAt': '2024-01-01T00:00:00.000Z',
+                'updatedBy': 'benchmark',
+                'updatedAt': '2024-01-01T00:00:00.000Z',
+            })
+        download_data.append({
+            'id': item_id,
+            'metadata': {'system': {'width': width,
+                                    'height': height,
+                                    'mimetype': rng.choice(MIMETYPES),
+                                    'size': width * height // 4}},
+            'annotations': annotations,
+        })
+    return download_data
@@ -1,12 +1,15 @@
 import os
+import tempfile
+import threading
 import time
 import traceback
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from urllib.parse import quote
 
 import dash_bootstrap_components as dbc
 import dtlpy as dl
-import pandas as pd
 import tqdm
 
 
@@ -14,10 +17,94 @@ from dash import dcc
 from dtlpy_exporter import ExportBase
 
 from utils.generate_graphs import GraphsCalculator
+from utils.aggregates import InsightsAggregates
+from utils.approximate import approximate_aggregates
+from utils.build_scheduler import BuildScheduler
+from utils.config import load_settings
+from utils.dashboard_cache import DashboardCache
+from utils.figure_store import FigureStore, deserialize_json, serialize_figure, serialize_json
+from utils.incremental import fetch_updated_items, list_item_ids, upsert_tables, utc_now
+from utils.insights_tables import InsightsTableHandle, build_tables, read_insights_table, write_insights_table
+from utils.memory import peak_rss_mb
+from utils.status_registry import status_registry
+from utils.table_cache import LocalTableCache
 
 logger = logging.getLogger('[INSIGHTS]')
 logging.basicConfig(level='INFO')
 
+_process_settings = load_settings()
+# serialized dashboard figures of all the datasets served by this process, by (dataset id, dashboard version)
+dashboard_cache = DashboardCache(
+    max_bytes=_process_settings['dashboard_cache_mb'] * 1024 ** 2,
+    ttl=_process_settings['dashboard_cache_ttl'],
+)
+# items and annotations tables of the datasets, shared by the processes of this host
+table_cache = LocalTableCache(
+    root=_process_settings['table_cache_dir'],
+    max_bytes=_process_settings['table_cache_mb'] * 1024 ** 2,
+)
+# export and build jobs of all the datasets served by this process
+build_scheduler = BuildScheduler(
+    max_workers=_process_settings['build_jobs'],
+    executor=_process_settings['build_executor'],
+)
+
+
+# dashboard graphs by card row: (graph id, GraphsCalculator method)
+GRAPH_ROWS = [
+    [
+        ('graph-1-1', 'histogram_annotation_by_item'),
+        ('graph-1-2', 'pie_annotation_type'),
+    ],
+    [
+        ('graph-2-1', 'bar_annotations_labels'),
+        ('graph-2-2', 'scatter_item_height_width'),
+    ],
+    # [
+    #     ('graph-3-1', 'pie_annotation_attributes'),
+    #     ('graph-3-2', 'sunburst_annotation_attribute_by_label'),
+    # ],
+    [
+        ('graph-4-1', 'heatmap_annotation_location'),
+        ('graph-4-2', 'scatter_annotation_height_width'),
+    ],
+]
+# GraphsCalculator method by graph id
+GRAPH_METHODS = {graph_id: method for row in GRAPH_ROWS for graph_id, method in row}
+
+
+def message_figure(text):
+    """
+    Returns:
+        dict: an empty figure showing `text`, e.g. while a graph loads or when it failed to render.
+    """
+    return {
+        'layout': {
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'paper_bgcolor': 'rgba(0,0,0,0)',
+            'plot_bgcolor': 'rgba(0,0,0,0)',
+            'annotations': [{'text': text, 'showarrow': False, 'xref': 'paper', 'yref': 'paper',
+                             'x': 0.5, 'y': 0.5, 'font': {'size': 16}}],
+        },
+    }
+
+
+# what a graph shows until its figure is fetched, once scrolled into view
+PLACEHOLDER_FIGURE = message_figure('Loading...')
+# what a graph shows when its figure can not be fetched, e.g. while the dashboard is rebuilt
+UNAVAILABLE_FIGURE = message_figure('Not available yet, reopen the insights once the build is done')
+# id of the label counts saved with the dashboard figures, which the labels histogram pages through
+LABEL_COUNTS_ID = 'label-counts'
+
+# remote directory of the insights artifacts (parquet tables, aggregates) of every dataset
+ARTIFACTS_DIR = '/.dataloop/exports/insights_parquet'
+# artifact name suffixes of an export, looked up together once per build (see `Exporter.find_artifacts`)
+ARTIFACT_SUFFIXES = ('items.parquet', 'annotations.parquet', 'aggregates.npz')
+
+# least seconds between two build progress updates, the last one is always published
+PROGRESS_INTERVAL = 0.5
+
 
 class BuildStatus(str, Enum):
     """
@@ -40,6 +127,33 @@ class BuildStatus(str, Enum):
     FAILED = "failed"
 
 
+class PublishedState:
+    """
+    Exporter attribute whose every assignment is also published to the status registry, under `field`.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name) from None
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        dataset = obj.__dict__.get('dataset')
+        if dataset is not None:
+            status_registry.update(dataset.id, **{self.field: getattr(value, 'value', value)})
+
+
 class Exporter(ExportBase):
     """
     A class used to export dataset insights and generate visualizations.
@@ -50,8 +164,9 @@ class Exporter(ExportBase):
         Configuration for Plotly graphs.
     settings : dict
         Settings for the visualizations.
-    divs : list
-        List of HTML div elements containing the graphs.
+    dashboard_version : str
+        Version of the last built dashboard, as published to the status registry by the process that
+        built it. Its key in `dashboard_cache` together with the dataset id.
     items_df : pd.DataFrame
         DataFrame containing item metadata.
     annotations_df : pd.DataFrame
@@ -59,26 +174,81 @@ class Exporter(ExportBase):
     gc : GraphsCalculator
         Instance of GraphsCalculator to generate graphs.
     path : str
-        Path to save temporary JSON files.
+        Path of the serialized figures (gzip-compressed JSON) of the dataset.
     build_status : str
-        Status of the build process.
+        Status of the build process, published to the status registry.
     build_progress : float
-        Progress of the build process.
+        Progress of the build process, published to the status registry.
+    items_processed : int
+        Exported items built into the DataFrames so far, published to the status registry.
+    items_total : int
+        Exported items to build into the DataFrames, published to the status registry.
+    build_rate : float
+        Items built per second, published to the status registry.
+    build_eta : float
+        Estimated seconds until the DataFrames are built, published to the status registry.
+    build_error : str
+        Traceback of the last failed build, published to the status registry.
+    approximate_dashboard : bool
+        Whether the last rendered dashboard shows approximate statistics, while the exact build runs,
+        published to the status registry.
+    snapshot : str
+        ISO time up to which the items and annotations tables are up to date.
+    aggregates : InsightsAggregates
+        Compact statistics of the tables, from which the graphs are rendered.
 
     Methods
     -------
     build_dataframe():
         Builds DataFrames from the downloaded data.
+    create_figures(graph_ids=None, serialize=False):
+        Computes the figures of all or some of the graphs concurrently.
     create_html():
         Creates HTML div elements containing the graphs.
-    get_parquet_files():
+    render_dashboard():
+        Serializes the figures once, to disk and to the dashboard cache.
+    render_approximate_dashboard():
+        Renders a dashboard of approximate statistics of the downloaded data.
+    get_dashboard():
+        Returns the HTML div elements of the last build.
+    get_figure(graph_id):
+        Returns a serialized figure of the last build.
+    get_label_counts(offset, limit):
+        Returns a page of the label counts of the last build.
+    publish_status(*names):
+        Publishes the export and build state to the status registry.
+    set_state(**values):
+        Sets several published attributes as a single status update.
+    find_artifacts():
+        Looks up the export item and its insights artifacts, once per build.
+    get_parquet_files(json_item, artifacts):
         Checks for existing Parquet files and loads them if available.
-    set_parquet_files():
+    get_parquet_tables(local_dir, artifacts):
+        Checks for existing Parquet files and opens lazy handles on them if available.
+    set_parquet_files(json_item):
         Saves the DataFrames as Parquet files and uploads them.
+    update_dataframes():
+        Applies the dataset changes since the DataFrames snapshot.
+    get_aggregates_file(artifacts):
+        Checks for an existing aggregates file and loads it if available.
+    set_aggregates_file(json_item):
+        Saves the aggregates and uploads them next to the Parquet files.
     process_data():
         Processes the data, builds DataFrames, saves Parquet files, and creates HTML divs.
     """
 
+    progress = PublishedState('exportProgress')
+    status = PublishedState('exportStatus')
+    last_update = PublishedState('exportDate')
+    build_status = PublishedState('buildStatus')
+    build_progress = PublishedState('buildProgress')
+    items_processed = PublishedState('itemsProcessed')
+    items_total = PublishedState('itemsTotal')
+    build_rate = PublishedState('buildRate')
+    build_eta = PublishedState('buildEta')
+    build_error = PublishedState('buildError')
+    approximate_dashboard = PublishedState('dashboardApproximate')
+
     def __init__(self, dataset_id):
         super().__init__(dataset_id)
         if not hasattr(self, 'default_graph_config'):
@@ -86,26 +256,83 @@ class Exporter(ExportBase):
                 'displaylogo': False,  # Hide Plotly logo
                 'modeBarButtonsToRemove': ['toImage'],  # Remove the download button
             }
-            self.settings = {"theme": "darkly"}
-            self.divs = list()
+            self.settings = load_settings()
+            self._render_lock = threading.Lock()
+            # loading figures into the dashboard cache does not wait for a build rendering its own
+            self._load_lock = threading.Lock()
             self.items_df = None
             self.annotations_df = None
             self.gc = GraphsCalculator()
             self.path = f'tmp/{self.dataset.id}/json'
             self.build_status = BuildStatus.READY
             self.build_progress = 0
+            self.items_processed = 0
+            self.items_total = 0
+            self.build_rate = None
+            self.build_eta = None
+            self.build_error = None
+            self.approximate_dashboard = False
+            self.snapshot = None
+            self.aggregates = None
+        if status_registry.get(self.dataset.id) is None:
+            self.publish_status()
+
+    @property
+    def dashboard_version(self):
+        """
+        Returns:
+            str: version of the last built dashboard, None if no build finished yet.
+        """
+        state = status_registry.get(self.dataset.id)
+        return None if state is None else state.get('dashboardVersion')
+
+    def publish_status(self, *names):
+        """
+        Publishes the current export and build state of the dataset to the status registry.
+
+        Args:
+            names (str): published attributes to publish. None given publishes all of them.
+        """
+        fields = dict()
+        for name, attribute in vars(Exporter).items():
+            if names and name not in names:
+                continue
+            if isinstance(attribute, PublishedState) and name in self.__dict__:
+                value = self.__dict__[name]
+                fields[attribute.field] = getattr(value, 'value', value)
+        status_registry.update(self.dataset.id, **fields)
+
+    def set_state(self, **values):
+        """
+        Sets several published attributes at once, and publishes them as a single status update, so
+        that status listeners get them together.
+
+        Args:
+            values: published attribute values by attribute name.
+        """
+        for name in values:
+            if not isinstance(vars(Exporter).get(name), PublishedState):
+                raise AttributeError(f'{name} is not a published attribute')
+        self.__dict__.update(values)
+        self.publish_status(*values)
 
     def build_dataframe(self):
         """
         Builds dataframes for items and annotations from the downloaded data.
 
-        This method processes the downloaded data to create two pandas DataFrames:
-        one for items and one for annotations. It uses a progress bar to track the
-        progress of the data processing.
+        This method streams the downloaded data into two columnar table builders:
+        one for items and one for annotations, so no per-row dicts are kept. With
+        `build_workers` > 1 in the settings, the data is sharded across a process pool
+        (`build_chunk_size` items per shard) and the partial tables are concatenated.
+        It uses a progress bar to track the progress of all shards, and publishes the
+        items processed, rate and ETA at most every `PROGRESS_INTERVAL` seconds.
 
         Attributes:
             self.download_data (list): List of downloaded data items.
             self.build_progress (float): Progress of the dataframe building process.
+            self.items_processed (int): Items built so far.
+            self.build_rate (float): Items built per second.
+            self.build_eta (float): Estimated seconds left.
             self.items_df (pd.DataFrame): DataFrame containing item information.
             self.annotations_df (pd.DataFrame): DataFrame containing annotation information.
 
@@ -113,242 +340,508 @@ class Exporter(ExportBase):
             Exception: If there is an error processing an item or annotation, it logs the exception.
 
         Logs:
-            Logs the time taken to collect files and load DataFrames.
+            Logs the time taken to build the DataFrames, and the peak RSS.
             Logs the number of items and annotations in the dataset and DataFrames.
         """
-        pbar = tqdm.tqdm(total=len(self.download_data))
-        items_dict = dict()
-        annotations_dict = dict()
+        total = len(self.download_data)
+        pbar = tqdm.tqdm(total=total)
         t = time.time()
-        for data in self.download_data:
-            item_id = data['id']
-            try:
-                items_dict[item_id] = {
-                    'item_id': data['id'],
-                    'width': data.get('metadata', {})
-                    .get('system', {})
-                    .get('width', 0),
-                    'height': data.get('metadata', {})
-                    .get('system', {})
-                    .get('height', 0),
-                    'mimetype': data.get('metadata', {})
-                    .get('system', {})
-                    .get('mimetype', ''),
-                    'size': data.get('metadata', {}).get('system', {}).get('size', 0),
-                }
-                collection = dl.AnnotationCollection.from_json(data['annotations'])
-                for annotation in collection:
-                    annotation: dl.Annotation
-                    try:
-                        annotations_dict[annotation.id] = {
-                            'item_id': item_id,
-                            'type': annotation.type,
-                            'annotation_id': annotation.id,
-                            'label': annotation.label,
-                            'top': annotation.top,
-                            'left': annotation.left,
-                            'bottom': annotation.bottom,
-                            'right': annotation.right,
-                            'annotation_height': annotation.bottom - annotation.top,
-                            'annotation_width': annotation.right - annotation.left,
-                            'attributes': None,
-                        }
-                    except (KeyError, TypeError, ValueError):
-                        logger.exception('failed in annotation: %s', annotation.id)
-            except (KeyError, TypeError, ValueError):
-                logger.exception('failed in item: %s', item_id)
-            finally:
-                pbar.update()
-                self.build_progress = min(pbar.n / pbar.total, 0.99)
+        last_published = t
+        self.set_state(items_processed=0, items_total=total, build_rate=None, build_eta=None)
+
+        def on_progress(processed):
+            nonlocal last_published
+            pbar.update(processed - pbar.n)
+            now = time.time()
+            if processed < total and now - last_published < PROGRESS_INTERVAL:
+                return
+            last_published = now
+            rate = processed / (now - t) if now > t else None
+            self.set_state(
+                build_progress=min(processed / total, 0.99),
+                items_processed=processed,
+                build_rate=rate,
+                build_eta=(total - processed) / rate if rate else None,
+            )
 
+        self.items_df, self.annotations_df = build_tables(
+            download_data=self.download_data,
+            max_workers=self.settings['build_workers'],
+            chunk_size=self.settings['build_chunk_size'],
+            progress_callback=on_progress,
+        )
+        pbar.close()
         logger.info('files collection time: %.2f[s]', time.time() - t)
-        t = time.time()
-        self.items_df = pd.DataFrame(items_dict.values())
-        self.annotations_df = pd.DataFrame(annotations_dict.values())
-        logger.info('DataFrame load time: %.2f[s]', time.time() - t)
+        logger.info('peak RSS: %.1f[MB]', peak_rss_mb())
         logger.info('num dataset items: %d', self.dataset.items_count)
         logger.info('num dataframe items: %d', self.items_df.shape[0])
         logger.info('num dataset annotations: %d', self.dataset.annotations_count)
         logger.info('num dataframe annotations: %d', self.annotations_df.shape[0])
 
+    def compute_figure(self, gc, graph_id, aggregates, serialize=False):
+        """
+        Computes the figure of a graph, timed. A graph that fails to render gets a figure telling so instead,
+        so that it does not fail the others.
+
+        Args:
+            gc (GraphsCalculator): calculator of the figure.
+            graph_id (str): graph id, as in `GRAPH_ROWS`.
+            aggregates (InsightsAggregates): statistics to render.
+            serialize (bool): return the serialized figure (see `serialize_figure`).
+
+        Returns:
+            go.Figure, dict (for a failed graph) or bytes when serialized.
+        """
+        t = time.time()
+        try:
+            fig = getattr(gc, GRAPH_METHODS[graph_id])(aggregates=aggregates, settings=self.settings)
+        except Exception as e:
+            logger.exception('failed to render graph %s of %s', graph_id, self.dataset.id)
+            fig = message_figure(f'This graph could not be rendered<br><sup>{type(e).__name__}: {e}</sup>')
+        if serialize:
+            fig = serialize_figure(fig)
+        logger.info('graph %s time: %.2f[s]', graph_id, time.time() - t)
+        return fig
+
+    def create_figures(self, graph_ids=None, serialize=False):
+        """
+        Computes the Plotly figures of the dashboard graphs from `aggregates`, on up to `figure_workers`
+        threads at once (see `compute_figure`).
+
+        Args:
+            graph_ids (list): graphs to compute, all of them by default.
+            serialize (bool): return the serialized figures, serialized by the threads computing them.
+
+        Returns:
+            dict: graph id -> go.Figure (a dict for failed graphs), or serialized figure bytes.
+        """
+        if graph_ids is None:
+            graph_ids = list(GRAPH_METHODS)
+        t = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, self.settings['figure_workers'])) as pool:
+            futures = {
+                graph_id: pool.submit(self.compute_figure,
+                                      gc=self.gc,
+                                      graph_id=graph_id,
+                                      aggregates=self.aggregates,
+                                      serialize=serialize)
+                for graph_id in graph_ids
+            }
+            figures = {graph_id: future.result() for graph_id, future in futures.items()}
+        logger.info('figures time: %.2f[s], graphs: %d', time.time() - t, len(figures))
+        return figures
+
     def create_html(self):
         """
         Creates a list of Dash Bootstrap Components (dbc) Containers, each containing
-        dbc Cards with Plotly Dash Graphs. The graphs are generated using various
-        methods from the `gc` (graph creator) object, which visualize different aspects
-        of the data stored in `annotations_df` and `items_df`.
+        dbc Cards with Plotly Dash Graphs, laid out as in `GRAPH_ROWS`.
+
+        The graphs are created as placeholders: each one comes with a dcc.Store holding the
+        URL of its serialized figure, which the page fetches as is once the graph is scrolled
+        into view (see `get_figure`), so the figures are never re-encoded per request, and
+        graphs nobody scrolls to are never fetched.
 
         Returns:
             list: A list of dbc.Container objects, each containing dbc.Card components
                   with dcc.Graph elements.
         """
-        divs = [
-            dbc.Container(
-                className='card-container',
-                children=[
-                    dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-1-1',
-                            figure=self.gc.histogram_annotation_by_item(
-                                df=self.annotations_df, settings=self.settings
-                            ),
-                            className="graph",
-                            config=self.default_graph_config,
-                        )
-                    ),
-                    dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-1-2',
-                            className="graph",
-                            figure=self.gc.pie_annotation_type(
-                                df=self.annotations_df, settings=self.settings
-                            ),
-                            config=self.default_graph_config,
-                        )
-                    ),
-                ],
-            ),
-            dbc.Container(
-                className='card-container',
-                children=[
-                    dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-2-1',
-                            className="graph",
-                            figure=self.gc.bar_annotations_labels(
-                                df=self.annotations_df, settings=self.settings
-                            ),
-                            config=self.default_graph_config,
-                        )
-                    ),
+        divs = list()
+        for row in GRAPH_ROWS:
+            cards = list()
+            for graph_id, _ in row:
+                cards.append(
                     dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-2-2',
-                            className="graph",
-                            figure=self.gc.scatter_item_height_width(
-                                df=self.items_df, settings=self.settings
+                        children=[
+                            dcc.Store(
+                                id=f'{graph_id}-src',
+                                data=f'/figures/{self.dataset.id}/{graph_id}'
+                                f'?version={quote(self.dashboard_version, safe="")}',
                             ),
-                            config=self.default_graph_config,
-                        )
-                    ),
-                ],
-            ),
-            # dbc.Container(className='card-container',
-            #               children=[
-            #                   dbc.Card(children=dcc.Graph(id='graph-3-1',
-            #                                               className="graph",
-            #                                               figure=self.gc.pie_annotation_attributes(
-            #                                                   df=self.annotations_df,
-            #                                                   settings=self.settings))),
-            #                   dbc.Card(children=dcc.Graph(id='graph-3-2',
-            #                                               className="graph",
-            #                                               figure=self.gc.sunburst_annotation_attribute_by_label(
-            #                                                   df=self.annotations_df,
-            #                                                   settings=self.settings)))
-            #               ], ),
-            dbc.Container(
-                className='card-container',
-                children=[
-                    dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-4-1',
-                            className="graph",
-                            figure=self.gc.heatmap_annotation_location(
-                                annotations_df=self.annotations_df,
-                                items_df=self.items_df,
-                                settings=self.settings,
-                            ),
-                            config=self.default_graph_config,
-                        )
-                    ),
-                    dbc.Card(
-                        children=dcc.Graph(
-                            id='graph-4-2',
-                            className="graph",
-                            figure=self.gc.scatter_annotation_height_width(
-                                df=self.annotations_df,
-                                settings=self.settings,
-                                max_item_width=self.items_df['height'].max(),
-                                max_item_height=self.items_df['height'].max(),
+                            dcc.Graph(
+                                id=graph_id,
+                                className="graph",
+                                figure=PLACEHOLDER_FIGURE,
+                                config=self.default_graph_config,
                             ),
-                            config=self.default_graph_config,
-                        )
-                    ),
-                ],
-            ),
-        ]
-
+                        ]
+                    )
+                )
+            divs.append(dbc.Container(className='card-container', children=cards))
         return divs
 
-    def get_parquet_files(self):
+    def render_dashboard(self):
+        """
+        Renders the graphs of `aggregates`, serializes each figure once (gzip-compressed JSON)
+        and saves them under `path`, replacing the previous dashboards of the dataset, then
+        publishes the new dashboard version.
+
+        The build may run in a worker process: the web process loads the saved figures into its
+        `dashboard_cache` on first request (see `get_figure`). The rendered figures and the
+        aggregates are not kept on the exporter.
+
+        The label counts are saved along, under `LABEL_COUNTS_ID`, for `get_label_counts`.
+
+        Returns:
+            dict: graph id -> serialized figure bytes.
+        """
+        self.gc.clear()
+        figures = self.create_figures(serialize=True)
+        self.gc.clear()
+        label_counts = self.aggregates.label_counts
+        figures[LABEL_COUNTS_ID] = serialize_json({
+            'labels': [str(label) for label in label_counts.index],
+            'counts': [int(count) for count in label_counts.values],
+        })
+        version = f'{self.output_item_ids[0]}/{self.aggregates.snapshot}'
+        store = FigureStore(root=self.path)
+        store.save(version=version, figures=figures)
+        status_registry.update(self.dataset.id, dashboardVersion=version)
+        self.aggregates = None
+        return figures
+
+    def render_approximate_dashboard(self):
+        """
+        Renders a dashboard of approximate statistics of the downloaded data, computed in a single pass
+        with exact counts and a reservoir sample of `approximate_sample_items` items for the annotation
+        geometry (see `utils.approximate`), and publishes it until the exact build is done. It needs the
+        whole export downloaded, so it only saves the table building time. The approximate aggregates are
+        not uploaded.
+        """
+        self.aggregates = approximate_aggregates(
+            download_data=self.download_data,
+            settings=self.settings,
+            sample_size=self.settings['approximate_sample_items'],
+            snapshot='approximate',
+        )
+        self.render_dashboard()
+        self.approximate_dashboard = True
+
+    def get_dashboard(self):
+        """
+        Returns the HTML div elements of the last build.
+
+        Returns:
+            list: HTML div elements, empty if no build finished yet.
+        """
+        if self.dashboard_version is None:
+            return list()
+        return self.create_html()
+
+    def get_figure(self, graph_id):
+        """
+        Returns a serialized figure of the last build.
+
+        Figures are served from `dashboard_cache`; when they were not loaded yet, evicted or
+        expired they are read back from `path` (replacing the older dashboards of the dataset in
+        the cache). The web process only loads finished artifacts: when the figures are not on disk
+        either (e.g. after a restart), a rebuild is scheduled on `build_scheduler` and None is
+        returned until it is done.
+
+        Args:
+            graph_id (str): graph id, as in `GRAPH_ROWS`.
+
+        Returns:
+            bytes: gzip-compressed figure JSON, or None if there is no such graph, no build
+            finished yet or its figures are being rebuilt.
+        """
+        version = self.dashboard_version
+        if version is None:
+            return None
+        key = (self.dataset.id, version)
+        figures = dashboard_cache.get(key)
+        if figures is None:
+            with self._load_lock:
+                figures = dashboard_cache.get(key)
+                if figures is None:
+                    figures = FigureStore(root=self.path).load(version=version)
+                    if figures is None:
+                        logger.info('figures of %s not found, scheduling a rebuild', self.dataset.id)
+                        schedule_export(dataset_id=self.dataset.id, use_cache='yes')
+                        return None
+                    dashboard_cache.invalidate(
+                        lambda cached: cached[0] == self.dataset.id and cached[1] != version
+                    )
+                    dashboard_cache.put(
+                        key=key,
+                        value=figures,
+                        size=sum(len(content) for content in figures.values()),
+                    )
+        return figures.get(graph_id)
+
+    def get_label_counts(self, offset, limit):
+        """
+        Returns a page of the label counts of the last build, most frequent first, as saved with its figures.
+
+        Args:
+            offset (int): labels to skip.
+            limit (int): most labels of the page.
+
+        Returns:
+            dict: the page `labels` and their `counts`, the `total` number of labels and the summed counts of
+            the labels `before` and `after` the page, or None if no build finished yet.
+        """
+        content = self.get_figure(graph_id=LABEL_COUNTS_ID)
+        if content is None:
+            return None
+        label_counts = deserialize_json(content)
+        counts = label_counts['counts']
+        end = offset + limit
+        return {
+            'offset': offset,
+            'total': len(counts),
+            'labels': label_counts['labels'][offset:end],
+            'counts': counts[offset:end],
+            'before': sum(counts[:offset]),
+            'after': sum(counts[end:]),
+        }
+
+    def get_parquet_files(self, json_item, artifacts):
         """
         Retrieves parquet files for items and annotations from a dataset.
 
         This method checks for the existence of parquet files for items and annotations
-        in a specified dataset. If both files are found, they are downloaded and loaded
-        into pandas DataFrames.
+        in a specified dataset. If both files are found, they are loaded into pandas DataFrames,
+        and the snapshot time stored with them is kept in `snapshot`.
+
+        The snapshot time is also kept in the metadata of the remote files, so that when the
+        tables of that snapshot are in the local `table_cache` they are memory-mapped from it
+        instead of being downloaded. Otherwise both files are downloaded and decoded concurrently,
+        and the downloaded tables are added to the cache.
+
+        Args:
+            json_item (dl.Item): the export item, from `find_artifacts`.
+            artifacts (dict): the artifacts found, from `find_artifacts`.
 
         Returns:
             bool: True if both parquet files are found and successfully loaded, False otherwise.
         """
-        json_item = dl.items.get(item_id=self.output_item_ids[0])
-        name, _ = os.path.splitext(json_item.name)
-        first_path = f'/.dataloop/exports/insights_parquet/{json_item.dataset_id}/{name}-items.parquet'
-        second_path = f'/.dataloop/exports/insights_parquet/{json_item.dataset_id}/{name}-annotations.parquet'
-        filters = dl.Filters(use_defaults=False, field='filename', values=first_path)
-        first_pages = json_item.dataset.items.list(filters=filters)
-        filters = dl.Filters(use_defaults=False, field='filename', values=second_path)
-        second_pages = json_item.dataset.items.list(filters=filters)
-        if first_pages.items_count != 0 and second_pages.items_count != 0:
+        name = self._export_name(json_item)
+        if 'items.parquet' in artifacts and 'annotations.parquet' in artifacts:
+            items_item = artifacts['items.parquet']
+            annotations_item = artifacts['annotations.parquet']
+            snapshot = self._remote_snapshot(items_item)
+            if snapshot is not None and snapshot == self._remote_snapshot(annotations_item):
+                tables = table_cache.get(dataset_id=self.dataset.id, version=f'{name}/{snapshot}')
+                if tables is not None:
+                    logger.info('found parquet files! loading cached dataframes of %s', snapshot)
+                    self.items_df = tables['items']
+                    self.annotations_df = tables['annotations']
+                    self.snapshot = snapshot
+                    return True
             logger.info('found parquet files! downloading existing dataframes')
-            self.items_df = pd.read_parquet(
-                first_pages.items[0].download(save_locally=False)
-            )
-            self.annotations_df = pd.read_parquet(
-                second_pages.items[0].download(save_locally=False)
-            )
+
+            def read_artifact(item):
+                return read_insights_table(item.download(save_locally=False))
+
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                items_read = pool.submit(read_artifact, items_item)
+                annotations_read = pool.submit(read_artifact, annotations_item)
+                self.items_df, metadata = items_read.result()
+                self.annotations_df, _ = annotations_read.result()
+            self.snapshot = metadata.get('snapshot')
+            if self.snapshot is not None:
+                table_cache.put(
+                    dataset_id=self.dataset.id,
+                    version=f'{name}/{self.snapshot}',
+                    tables={'items': self.items_df, 'annotations': self.annotations_df},
+                )
             return True
         else:
             return False
 
-    def set_parquet_files(self):
+    def get_parquet_tables(self, local_dir, artifacts):
+        """
+        Opens lazy handles on the parquet files of the dataset, downloaded to `local_dir`, for
+        computing statistics that only read some of the columns (see `InsightsAggregates.from_handles`),
+        instead of loading the whole tables into DataFrames. The snapshot time stored with the tables
+        is kept in `snapshot`.
+
+        Args:
+            local_dir (str): directory to download the parquet files to, kept while the handles are used.
+            artifacts (dict): the artifacts found, from `find_artifacts`.
+
+        Returns:
+            tuple: (items, annotations) InsightsTableHandle, or None if the parquet files are not found.
+        """
+        if 'items.parquet' not in artifacts or 'annotations.parquet' not in artifacts:
+            return None
+        logger.info('found parquet files! downloading them for column reads')
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            items_path, annotations_path = pool.map(
+                lambda item: item.download(local_path=local_dir),
+                [artifacts['items.parquet'], artifacts['annotations.parquet']],
+            )
+        items = InsightsTableHandle(items_path)
+        annotations = InsightsTableHandle(annotations_path)
+        self.snapshot = items.metadata.get('snapshot')
+        return items, annotations
+
+    def find_artifacts(self):
+        """
+        Fetches the item of the current export and looks up all its insights artifacts (`ARTIFACT_SUFFIXES`)
+        with a single query, for the getters and setters of a build to share.
+
+        Returns:
+            tuple: the export dl.Item, and a dict of the artifacts found, suffix -> dl.Item.
+        """
+        json_item = dl.items.get(item_id=self.output_item_ids[0])
+        name = self._export_name(json_item)
+        paths = {f'{ARTIFACTS_DIR}/{json_item.dataset_id}/{name}-{suffix}': suffix for suffix in ARTIFACT_SUFFIXES}
+        filters = dl.Filters(
+            use_defaults=False,
+            field='filename',
+            values=list(paths),
+            operator=dl.FiltersOperations.IN,
+        )
+        pages = json_item.dataset.items.list(filters=filters)
+        return json_item, {paths[item.filename]: item for item in pages.all() if item.filename in paths}
+
+    @staticmethod
+    def _export_name(json_item):
+        name, _ = os.path.splitext(json_item.name)
+        return name
+
+    @staticmethod
+    def _upload_artifact(json_item, local_path, remote_name, item_metadata=None):
+        json_item.dataset.items.upload(
+            local_path=local_path,
+            remote_path=f'{ARTIFACTS_DIR}/{json_item.dataset_id}',
+            remote_name=remote_name,
+            item_metadata=item_metadata,
+            overwrite=True,
+        )
+
+    @staticmethod
+    def _remote_snapshot(item):
+        return item.metadata.get('user', dict()).get('insights', dict()).get('snapshot')
+
+    def set_parquet_files(self, json_item):
         """
         Converts items and annotations DataFrames to Parquet files, uploads them to a remote path, and removes the local files.
 
         This method performs the following steps:
-        1. Retrieves the first output item using its ID.
+        1. Takes the export item, as fetched by `find_artifacts`.
         2. Extracts the name of the item (without extension).
-        3. Converts the items DataFrame to a Parquet file and saves it locally.
-        4. Constructs the remote path for the items Parquet file.
-        5. Uploads the items Parquet file to the remote path.
-        6. Constructs the remote path for the annotations Parquet file.
-        7. Converts the annotations DataFrame to a Parquet file and saves it locally.
-        8. Uploads the annotations Parquet file to the remote path.
-        9. Removes the local Parquet files.
+        3. Converts the items DataFrame to a Parquet file, with the tables snapshot time, and saves it
+           in a temporary directory.
+        4. Starts uploading the items Parquet file in the background, with the snapshot time in its metadata.
+        5. Converts the annotations DataFrame to a Parquet file meanwhile, and saves it in the temporary directory.
+        6. Starts uploading the annotations Parquet file in the background, with the snapshot time in its metadata.
+        7. Adds the DataFrames to the local `table_cache` while the files upload.
+        8. Waits for both uploads and removes the temporary directory.
+
+        Args:
+            json_item (dl.Item): the export item, from `find_artifacts`.
 
         Raises:
             Any exceptions raised by the underlying methods for file operations and uploads.
         """
-        json_item = dl.items.get(item_id=self.output_item_ids[0])
-        name, _ = os.path.splitext(json_item.name)
-        self.items_df.to_parquet(f'{json_item.id}-items.parquet')
-        remote_path = f'/.dataloop/exports/insights_parquet/{json_item.dataset_id}/{name}-items.parquet'
-        json_item.dataset.items.upload(
-            local_path=f'{json_item.id}-items.parquet',
-            remote_path=os.path.dirname(remote_path),
-            remote_name=os.path.basename(remote_path),
+        name = self._export_name(json_item)
+        if self.snapshot is None:
+            # fresh build from the export, its tables are as recent as the export file
+            self.snapshot = json_item.created_at
+        item_metadata = {'user': {'insights': {'snapshot': self.snapshot}}}
+        tables = [
+            ('items', self.items_df, {'snapshot': self.snapshot}),
+            ('annotations', self.annotations_df, None),
+        ]
+        with tempfile.TemporaryDirectory() as local_dir, ThreadPoolExecutor(max_workers=2) as pool:
+            uploads = list()
+            for table_name, df, metadata in tables:
+                local_path = os.path.join(local_dir, f'{json_item.id}-{table_name}.parquet')
+                write_insights_table(df, local_path, metadata=metadata, table_name=table_name)
+                uploads.append(pool.submit(
+                    self._upload_artifact,
+                    json_item=json_item,
+                    local_path=local_path,
+                    remote_name=f'{name}-{table_name}.parquet',
+                    item_metadata=item_metadata,
+                ))
+            table_cache.put(
+                dataset_id=self.dataset.id,
+                version=f'{name}/{self.snapshot}',
+                tables={'items': self.items_df, 'annotations': self.annotations_df},
+            )
+            for upload in uploads:
+                upload.result()
+
+    def get_aggregates_file(self, artifacts):
+        """
+        Retrieves the aggregates file saved next to the parquet files of the dataset.
+
+        The aggregates hold everything the graphs need (label and type counts, annotations per
+        item, item and annotation sizes, location density), so when they are found the raw
+        parquet tables don't have to be downloaded at all.
+
+        Args:
+            artifacts (dict): the artifacts found, from `find_artifacts`.
+
+        Returns:
+            bool: True if the aggregates file is found and loaded into `aggregates`, False otherwise.
+        """
+        if 'aggregates.npz' not in artifacts:
+            return False
+        logger.info('found aggregates file! downloading existing aggregates')
+        self.aggregates = InsightsAggregates.load(artifacts['aggregates.npz'].download(save_locally=False))
+        return True
+
+    def set_aggregates_file(self, json_item):
+        """
+        Saves `aggregates` as a compressed .npz file in a temporary directory, uploads it next to
+        the parquet files and removes the local file.
+
+        Args:
+            json_item (dl.Item): the export item, from `find_artifacts`.
+        """
+        name = self._export_name(json_item)
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_path = os.path.join(local_dir, f'{json_item.id}-aggregates.npz')
+            self.aggregates.save(local_path)
+            self._upload_artifact(json_item=json_item, local_path=local_path, remote_name=f'{name}-aggregates.npz')
+
+    def update_dataframes(self):
+        """
+        Incrementally updates the loaded DataFrames with the dataset changes since their snapshot.
+
+        Items updated since the snapshot, or with annotations updated since then, are fetched with
+        their annotations and their rows are replaced. When the number of items no longer matches
+        the dataset (re-fetched, as its item count is cached with it), the deleted items are found by
+        listing the dataset item ids and their rows are dropped.
+
+        Returns:
+            bool: True if the DataFrames were updated, False if there was nothing to update or the
+            cached tables have no snapshot time (written before incremental updates existed).
+        """
+        if self.snapshot is None:
+            logger.info('cached dataframes have no snapshot time, skipping incremental update')
+            return False
+        t = time.time()
+        snapshot = utc_now()
+        self.dataset = dl.datasets.get(dataset_id=self.dataset.id)
+        changed_data = fetch_updated_items(dataset=self.dataset, snapshot=self.snapshot)
+        changed_items_df, changed_annotations_df = build_tables(download_data=changed_data)
+        removed_item_ids = set()
+        num_items = len(set(self.items_df['item_id']) | set(changed_items_df['item_id']))
+        if num_items != self.dataset.items_count:
+            removed_item_ids = set(self.items_df['item_id']) - list_item_ids(dataset=self.dataset)
+        if not changed_data and not removed_item_ids:
+            logger.info('no changes since %s', self.snapshot)
+            return False
+        self.items_df, self.annotations_df = upsert_tables(
+            items_df=self.items_df,
+            annotations_df=self.annotations_df,
+            changed_items_df=changed_items_df,
+            changed_annotations_df=changed_annotations_df,
+            removed_item_ids=removed_item_ids,
         )
-        remote_path = f'/.dataloop/exports/insights_parquet/{json_item.dataset_id}/{name}-annotations.parquet'
-        self.annotations_df.to_parquet(f'{json_item.id}-annotations.parquet')
-        json_item.dataset.items.upload(
-            local_path=f'{json_item.id}-annotations.parquet',
-            remote_path=os.path.dirname(remote_path),
-            remote_name=os.path.basename(remote_path),
+        self.snapshot = snapshot
+        logger.info(
+            'incremental update time: %.2f[s], changed items: %d, removed items: %d',
+            time.time() - t,
+            len(changed_data),
+            len(removed_item_ids),
         )
-
-        # remove local files
-        os.remove(f'{json_item.id}-items.parquet')
-        os.remove(f'{json_item.id}-annotations.parquet')
+        return True
 
     def process_data(self, **kwargs):
         """
@@ -356,45 +849,148 @@ class Exporter(ExportBase):
         and creating HTML. Updates the build status and progress throughout the process.
 
         Steps:
-        1. Sets initial progress and status.
-        2. Attempts to download parquet files.
-        3. If parquet files are not available, builds the dataframe and sets parquet files.
-        4. Clears garbage collection.
-        5. Creates HTML from the data.
-        6. Updates the build status to ready and resets dataframes.
+        1. Sets initial progress and status, and looks up the artifacts of the export once.
+        2. Attempts to download the aggregates file, and if it is available (and no incremental
+           update is configured) skips the raw parquet files altogether. Without it, the aggregates
+           are computed from column reads of the parquet files, when they are available.
+        3. Otherwise attempts to download parquet files. If they are not available, builds the
+           dataframe and sets parquet files; datasets with `approximate_min_annotations` or more
+           annotations first get an approximate dashboard, rendered from a single pass over the
+           export. With `incremental_update` in the settings, applies the dataset changes since
+           the parquet snapshot and writes the merged parquet files back.
+        4. Computes and uploads the aggregates when the tables changed or had none, then resets
+           the dataframes.
+        5. Renders the graphs from the aggregates into the figure store, holding the render lock, as the
+           builds share the graphs calculator.
+        6. Updates the build status to ready.
 
         Attributes:
             progress (int): Initial progress set to 100.
             build_status (str): Status of the build process.
             build_progress (float): Progress of the build process.
-            divs (list): HTML divisions created from the data.
+            aggregates (InsightsAggregates): Statistics the graphs are rendered from.
+            dashboard_version (str): Version of the dashboard saved under `path`.
+            approximate_dashboard (bool): Whether that dashboard is the approximate one.
             items_df (DataFrame): DataFrame containing items data.
             annotations_df (DataFrame): DataFrame containing annotations data.
 
         Exceptions:
             Catches any exception during the process and updates the build status to "failed"
-            and sets the build progress to the exception traceback.
+            and sets the build error to the exception traceback.
         """
         self.progress = 100
-        self.build_status = BuildStatus.STARTED
-        self.build_progress = 0
+        self.set_state(
+            build_status=BuildStatus.STARTED,
+            build_progress=0,
+            items_processed=0,
+            items_total=0,
+            build_rate=None,
+            build_eta=None,
+            build_error=None,
+            approximate_dashboard=False,
+        )
+        self.snapshot = None
         try:
             self.build_status = BuildStatus.DOWNLOADING
-            if self.get_parquet_files() is not True:
-
-                self.build_status = BuildStatus.BUILDING
-                self.build_dataframe()
-                self.set_parquet_files()
-            self.gc.clear()
+            json_item, artifacts = self.find_artifacts()
+            has_aggregates = self.get_aggregates_file(artifacts=artifacts)
+            if not has_aggregates and not self.settings['incremental_update']:
+                # the tables are only needed for their aggregates, read them column by column
+                with tempfile.TemporaryDirectory() as local_dir:
+                    tables = self.get_parquet_tables(local_dir=local_dir, artifacts=artifacts)
+                    if tables is not None:
+                        self.build_status = BuildStatus.BUILDING
+                        self.aggregates = InsightsAggregates.from_handles(
+                            items=tables[0],
+                            annotations=tables[1],
+                            settings=self.settings,
+                            snapshot=self.snapshot,
+                        )
+                        self.set_aggregates_file(json_item=json_item)
+                        has_aggregates = True
+            if not has_aggregates or self.settings['incremental_update']:
+                updated = False
+                if self.get_parquet_files(json_item=json_item, artifacts=artifacts) is not True:
+
+                    self.build_status = BuildStatus.BUILDING
+                    if 0 < self.settings['approximate_min_annotations'] <= self.dataset.annotations_count:
+                        with self._render_lock:
+                            self.render_approximate_dashboard()
+                    self.build_dataframe()
+                    self.set_parquet_files(json_item=json_item)
+                    updated = True
+                elif self.settings['incremental_update']:
+                    self.build_status = BuildStatus.BUILDING
+                    updated = self.update_dataframes()
+                    if updated:
+                        self.set_parquet_files(json_item=json_item)
+                if updated or not has_aggregates:
+                    self.build_status = BuildStatus.BUILDING
+                    self.aggregates = InsightsAggregates.from_tables(
+                        items_df=self.items_df,
+                        annotations_df=self.annotations_df,
+                        settings=self.settings,
+                        snapshot=self.snapshot,
+                    )
+                    self.set_aggregates_file(json_item=json_item)
+                self.items_df = None
+                self.annotations_df = None
             self.build_status = BuildStatus.CREATING
             self.build_progress = 0.995
-            self.divs = self.create_html()
+            with self._render_lock:
+                self.render_dashboard()
 
-            self.build_status = BuildStatus.READY
-            self.build_progress = 1
-            self.items_df = None
-            self.annotations_df = None
+            self.set_state(build_status=BuildStatus.READY, build_progress=1, approximate_dashboard=False)
         except Exception as e:
-            self.build_status = BuildStatus.FAILED
-            self.build_progress = traceback.format_exc()
+            self.set_state(build_status=BuildStatus.FAILED,
+                           build_error=traceback.format_exc(),
+                           approximate_dashboard=False)
             logger.exception('failed to process data: %s', e)
+
+
+def run_export(dataset_id, use_cache):
+    """
+    Exports and builds the insights of a dataset, as a build scheduler job (possibly in a build
+    worker process).
+
+    Args:
+        dataset_id (str): The ID of the dataset.
+        use_cache (str): Whether to reuse the cached export ('yes') or not ('no').
+    """
+    Exporter(dataset_id=dataset_id).check_and_run(use_cache=use_cache)
+
+
+def schedule_export(dataset_id, use_cache):
+    """
+    Queues the export and build of a dataset on `build_scheduler`, or attaches to the one in flight.
+
+    A job that fails outside of `process_data` (the export, or a build worker that died) is
+    published as a failed build.
+
+    Args:
+        dataset_id (str): The ID of the dataset.
+        use_cache (str): Whether to reuse the cached export ('yes') or not ('no').
+
+    Returns:
+        bool: True if a new job was queued, False if it attached to the job in flight.
+    """
+    exporter = Exporter(dataset_id=dataset_id)
+
+    def reset_progress():
+        exporter.progress = 0
+
+    def on_done(job):
+        if job.cancelled() or job.exception() is None:
+            return
+        exporter.set_state(
+            build_status=BuildStatus.FAILED,
+            build_error=''.join(traceback.format_exception(job.exception())),
+            approximate_dashboard=False,
+        )
+
+    job, created = build_scheduler.submit(
+        dataset_id, run_export, dataset_id, use_cache=use_cache, prepare=reset_progress
+    )
+    if created:
+        job.add_done_callback(on_done)
+    return created
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+
+from utils.heatmap import DensityGrid
+
+# non-empty cells of a SparseBins2D, above which its cells are coarsened
+DEFAULT_MAX_CELLS = 1 << 18
+# first cell size of a SparseBins2D of continuous values
+CONTINUOUS_BIN_SIZE = 1 / 16
+
+# a SparseBins2D cell key packs the x cell index in the high and the (offset) y cell index in the low 32 bits
+_Y_OFFSET = 1 << 31
+_Y_SPAN = 1 << 32
+
+
+# partial counts buffered by a ValueCounts/CountHistogram before they are added up
+_MAX_PENDING_COUNTS = 64
+
+
+def _add_counts(counts, other):
+    if counts.empty:
+        return other.astype(np.int64)
+    if other.empty:
+        return counts
+    return counts.add(other, fill_value=0).astype(np.int64)
+
+
+class _KeyCounts:
+    # row counts by the values of a column, summed lazily: adding each batch to the counts of all the
+    # batches before would cost the number of distinct values per batch
+
+    def __init__(self, column):
+        self.column = column
+        self._counts = pd.Series(dtype=np.int64)
+        self._pending = list()
+
+    def _sum_pending(self):
+        if self._pending:
+            counts = pd.concat([self._counts, *self._pending])
+            self._counts = counts.groupby(level=0, sort=False).sum().astype(np.int64)
+            self._pending = list()
+
+    @property
+    def counts(self):
+        self._sum_pending()
+        return self._counts
+
+    def _add(self, counts):
+        self._pending.append(counts)
+        if len(self._pending) > _MAX_PENDING_COUNTS:
+            self._sum_pending()
+
+    def update(self, batch):
+        """
+        Args:
+            batch (pd.DataFrame): rows with the counted column. Missing values are not counted.
+        """
+        counts = batch[self.column].value_counts()
+        counts = counts[counts > 0]
+        counts.index = counts.index.astype(str)
+        self._add(counts.astype(np.int64))
+
+    def merge(self, other):
+        """
+        Args:
+            other: counts of the same column to add to these ones.
+        """
+        self._add(other.counts)
+
+    def serialize(self):
+        """
+        Returns:
+            dict: name -> np.ndarray, see `deserialize`.
+        """
+        counts = self.counts
+        return {
+            'kind': np.str_(type(self).__name__),
+            'column': np.str_(self.column),
+            'names': np.array(counts.index.tolist(), dtype=str),
+            'counts': counts.to_numpy(dtype=np.int64),
+        }
+
+    @classmethod
+    def from_serialized(cls, data):
+        accumulator = cls(str(data['column']))
+        accumulator._counts = pd.Series(data['counts'], index=data['names'].tolist(), dtype=np.int64)
+        return accumulator
+
+
+class ValueCounts(_KeyCounts):
+    """
+    Mergeable number of rows by value of a column (e.g. annotations by label or type).
+
+    Attributes:
+        column (str): counted column.
+        counts (pd.Series): count by value, in no particular order.
+    """
+
+    def result(self):
+        """
+        Returns:
+            pd.Series: count by value, most frequent first.
+        """
+        counts = self.counts[self.counts > 0]
+        return counts.sort_values(ascending=False, kind='stable').rename('count')
+
+
+class CountHistogram(_KeyCounts):
+    """
+    Mergeable histogram of the number of rows per key (e.g. annotations per item).
+
+    The counts of every key are kept until `result`, so that batches and shards splitting the rows of a
+    key merge exactly.
+
+    Attributes:
+        column (str): key column.
+        counts (pd.Series): row count by key.
+    """
+
+    def result(self):
+        """
+        Returns:
+            np.ndarray: number of keys by their number of rows (index), counting keys with rows only.
+        """
+        per_key = self.counts.to_numpy(dtype=np.int64)
+        per_key = per_key[per_key > 0]
+        return np.bincount(per_key) if per_key.size else np.zeros(1, dtype=np.int64)
+
+
+class SparseBins2D:
+    """
+    Mergeable 2D histogram of two columns (e.g. width and height), on a sparse grid of square cells of
+    `bin_size` units: only the non-empty cells are kept. Cells start at one unit for `discrete` values,
+    which keeps them exactly, or `CONTINUOUS_BIN_SIZE` otherwise, and double in size whenever there are
+    more than `max_cells` non-empty cells.
+
+    Attributes:
+        x (str): column of the first axis.
+        y (str): column of the second axis.
+        discrete (bool): whether the values are integers, see `result`.
+        max_cells (int): most non-empty cells kept.
+        bin_size (float): cell size, a power of two.
+        extent (np.ndarray): min x, max x, min y and max y of the values, exactly.
+    """
+
+    def __init__(self, x, y, discrete=False, max_cells=DEFAULT_MAX_CELLS):
+        self.x = x
+        self.y = y
+        self.discrete = discrete
+        self.max_cells = max_cells
+        self.bin_size = 1.0 if discrete else CONTINUOUS_BIN_SIZE
+        self.extent = np.array([np.inf, -np.inf, np.inf, -np.inf])
+        self._cells = pd.Series(dtype=np.int64)
+
+    @staticmethod
+    def _keys(x_cells, y_cells):
+        return x_cells * _Y_SPAN + (y_cells + _Y_OFFSET)
+
+    @staticmethod
+    def _cell_indices(keys):
+        y_cells = keys % _Y_SPAN - _Y_OFFSET
+        return (keys - (y_cells + _Y_OFFSET)) // _Y_SPAN, y_cells
+
+    def _rebinned(self, cells, factor):
+        if factor == 1 or cells.empty:
+            return cells
+        x_cells, y_cells = self._cell_indices(cells.index.to_numpy(dtype=np.int64))
+        keys = self._keys(x_cells // factor, y_cells // factor)
+        return cells.groupby(keys).sum()
+
+    def _fit(self):
+        while len(self._cells) > self.max_cells:
+            self._cells = self._rebinned(self._cells, 2)
+            self.bin_size *= 2
+
+    def update(self, batch):
+        """
+        Args:
+            batch (pd.DataFrame): rows with the `x` and `y` columns. Rows with a non-finite value are left out.
+        """
+        xs = batch[self.x].to_numpy(dtype=np.float64)
+        ys = batch[self.y].to_numpy(dtype=np.float64)
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        xs, ys = xs[finite], ys[finite]
+        if xs.size == 0:
+            return
+        self.extent = np.array([min(self.extent[0], xs.min()), max(self.extent[1], xs.max()),
+                                min(self.extent[2], ys.min()), max(self.extent[3], ys.max())])
+        keys = self._keys(np.floor(xs / self.bin_size).astype(np.int64),
+                          np.floor(ys / self.bin_size).astype(np.int64))
+        keys, counts = np.unique(keys, return_counts=True)
+        self._cells = _add_counts(self._cells, pd.Series(counts, index=keys, dtype=np.int64))
+        self._fit()
+
+    def merge(self, other):
+        """
+        Args:
+            other (SparseBins2D): bins of the same columns to add to these ones, at the coarser cell size
+                of the two.
+        """
+        bin_size = max(self.bin_size, other.bin_size)
+        self._cells = self._rebinned(self._cells, int(bin_size / self.bin_size))
+        self.bin_size = bin_size
+        self._cells = _add_counts(self._cells, self._rebinned(other._cells, int(bin_size / other.bin_size)))
+        self.extent = np.array([min(self.extent[0], other.extent[0]), max(self.extent[1], other.extent[1]),
+                                min(self.extent[2], other.extent[2]), max(self.extent[3], other.extent[3])])
+        self._fit()
+
+    def serialize(self):
+        """
+        Returns:
+            dict: name -> np.ndarray, see `deserialize`.
+        """
+        return {
+            'kind': np.str_(type(self).__name__),
+            'columns': np.array([self.x, self.y], dtype=str),
+            'discrete': np.bool_(self.discrete),
+            'max_cells': np.int64(self.max_cells),
+            'bin_size': np.float64(self.bin_size),
+            'extent': self.extent,
+            'keys': self._cells.index.to_numpy(dtype=np.int64),
+            'counts': self._cells.to_numpy(dtype=np.int64),
+        }
+
+    @classmethod
+    def from_serialized(cls, data):
+        x, y = data['columns'].tolist()
+        accumulator = cls(x=x, y=y, discrete=bool(data['discrete']), max_cells=int(data['max_cells']))
+        accumulator.bin_size = float(data['bin_size'])
+        accumulator.extent = np.array(data['extent'], dtype=np.float64)
+        accumulator._cells = pd.Series(data['counts'], index=data['keys'], dtype=np.int64)
+        return accumulator
+
+    def result(self):
+        """
+        Returns:
+            pd.DataFrame: `x`, `y` and `count` of the non-empty cells, each at its middle within `extent`;
+                of `discrete` values, at the middle of the integer values it holds (the values themselves
+                with one unit cells).
+        """
+        x_cells, y_cells = self._cell_indices(self._cells.index.to_numpy(dtype=np.int64))
+        middle = (self.bin_size - 1) / 2 if self.discrete else self.bin_size / 2
+        xs = np.clip(x_cells * self.bin_size + middle, self.extent[0], self.extent[1])
+        ys = np.clip(y_cells * self.bin_size + middle, self.extent[2], self.extent[3])
+        return pd.DataFrame({self.x: xs, self.y: ys, 'count': self._cells.to_numpy(dtype=np.int64)})
+
+
+# accumulator classes by serialized kind
+ACCUMULATOR_TYPES = {cls.__name__: cls for cls in (ValueCounts, CountHistogram, SparseBins2D, DensityGrid)}
+
+
+def deserialize(data):
+    """
+    Rebuilds an accumulator from its `serialize()` output.
+
+    Every accumulator (`ValueCounts`, `CountHistogram`, `SparseBins2D`, `DensityGrid`) has `update(batch)`
+    to add a batch of rows, `merge(other)` to add a partial accumulator of other rows, `serialize()` and
+    `result()`. Serialized accumulators are plain dicts of NumPy arrays, e.g. for `np.savez`.
+
+    Args:
+        data (dict): name -> np.ndarray.
+
+    Returns:
+        the accumulator.
+    """
+    return ACCUMULATOR_TYPES[str(data['kind'])].from_serialized(data)
+
+
+def serialize_all(accumulators):
+    """
+    Args:
+        accumulators (dict): accumulator by name.
+
+    Returns:
+        dict: the serialized accumulators, flattened to '<name>/<field>' -> np.ndarray.
+    """
+    return {f'{name}/{field}': value
+            for name, accumulator in accumulators.items()
+            for field, value in accumulator.serialize().items()}
+
+
+def deserialize_all(data):
+    """
+    Args:
+        data (dict or np.lib.npyio.NpzFile): accumulators serialized by `serialize_all`.
+
+    Returns:
+        dict: accumulator by name.
+    """
+    fields = dict()
+    for key in data.keys():
+        name, _, field = key.partition('/')
+        if field:
+            fields.setdefault(name, dict())[field] = data[key]
+    return {name: deserialize(values) for name, values in fields.items()}
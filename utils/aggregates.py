@@ -0,0 +1,354 @@
+import numpy as np
+import pandas as pd
+
+from utils.accumulators import CountHistogram, SparseBins2D, ValueCounts, deserialize_all, serialize_all
+from utils.heatmap import DEFAULT_MAX_GROUPS, DEFAULT_RESOLUTION, DensityGrid, accumulate_density, item_sizes
+
+AGGREGATES_VERSION = 1
+DEFAULT_SIZE_BINS = 256
+
+
+def _binned_sizes(sizes, extent, bins):
+    # re-bins the size cells on a regular grid of `bins` x `bins` over the range of the sizes
+    if sizes.empty:
+        return pd.DataFrame({'annotation_width': [], 'annotation_height': [], 'count': []})
+    width_edges = np.linspace(min(extent[0], 0), max(extent[1], 1), bins + 1)
+    height_edges = np.linspace(min(extent[2], 0), max(extent[3], 1), bins + 1)
+    counts, _, _ = np.histogram2d(sizes['annotation_width'], sizes['annotation_height'],
+                                  bins=[width_edges, height_edges], weights=sizes['count'])
+    i_width, i_height = np.nonzero(counts)
+    return pd.DataFrame({
+        'annotation_width': (width_edges[i_width] + width_edges[i_width + 1]) / 2,
+        'annotation_height': (height_edges[i_height] + height_edges[i_height + 1]) / 2,
+        'count': counts[i_width, i_height].astype(np.int64),
+    })
+
+
+class InsightsAccumulator:
+    """
+    Mergeable partial aggregates: one accumulator per chart statistic, updated batch by batch. Accumulators
+    of batches or shards of the tables merge into the accumulator of the whole tables, and are serialized
+    to be kept and merged later (see `utils.accumulators`).
+
+    Items are added with `update_items`. Annotations are added in two passes: `update_annotations` counts
+    them, then `update_locations` accumulates their location density, normalized by the size of their items,
+    on per-label/type grids of the values most counted by the first pass. Shards that are merged must share
+    the same grids: pass them the `density_groups` of their merged counts.
+
+    Attributes:
+        value_counts (dict): ValueCounts of the annotations, by column ('label', 'type' and the heatmap
+            `group_by` column).
+        annotations_per_item (CountHistogram): annotations per item.
+        item_sizes (SparseBins2D): item width/height.
+        annotation_sizes (SparseBins2D): annotation width/height.
+        density (DensityGrid): annotation location density, None before `update_locations`.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.group_by = settings.get('heatmap_group_by')
+        self.value_counts = {column: ValueCounts(column)
+                             for column in dict.fromkeys(['label', 'type', self.group_by]) if column is not None}
+        self.annotations_per_item = CountHistogram('item_id')
+        self.item_sizes = SparseBins2D(x='width', y='height', discrete=True)
+        self.annotation_sizes = SparseBins2D(x='annotation_width', y='annotation_height')
+        self.density = None
+        self._items = list()
+        self._sizes = None
+
+    def _parts(self):
+        parts = {f'counts.{column}': counts for column, counts in self.value_counts.items()}
+        parts.update(annotations_per_item=self.annotations_per_item,
+                     item_sizes=self.item_sizes,
+                     annotation_sizes=self.annotation_sizes)
+        if self.density is not None:
+            parts['density'] = self.density
+        return parts
+
+    def update_items(self, batch):
+        """
+        Args:
+            batch (pd.DataFrame): items with `item_id`, `width` and `height` columns.
+        """
+        self.item_sizes.update(batch)
+        self._items.append(batch[['item_id', 'width', 'height']])
+        self._sizes = None
+
+    def update_annotations(self, batch):
+        """
+        Args:
+            batch (pd.DataFrame): annotations with `item_id`, `label`, `type`, `annotation_width` and
+                `annotation_height` columns, and the heatmap `group_by` column.
+        """
+        for counts in self.value_counts.values():
+            counts.update(batch)
+        self.annotations_per_item.update(batch)
+        self.annotation_sizes.update(batch)
+
+    def density_groups(self):
+        """
+        Returns:
+            list: values of the heatmap `group_by` column that get their own density grid, the most
+                counted ones.
+        """
+        if self.group_by is None:
+            return list()
+        counts = self.value_counts[self.group_by].result()
+        return counts.index[:DEFAULT_MAX_GROUPS].tolist()
+
+    def update_locations(self, batches, groups=None, items=None):
+        """
+        Args:
+            batches (pd.DataFrame or iterable): annotations, or batches of them, with `item_id`, `left`, `top`,
+                `right` and `bottom` columns, and the heatmap `group_by` column. Chunked density passes (see
+                `heatmap_chunk_size`) use one pool for all the batches of a call, so stream them in one call.
+            groups (list): values with their own density grid, by default the `density_groups` of the
+                annotations counted so far. Only used by the first call.
+            items (pd.DataFrame): items of the annotations, with `item_id`, `width` and `height` columns,
+                when they were not added to this accumulator with `update_items`.
+        """
+        if self.density is None:
+            self.density = DensityGrid(resolution=self.settings.get('heatmap_resolution', DEFAULT_RESOLUTION),
+                                       group_by=self.group_by,
+                                       groups=self.density_groups() if groups is None else groups)
+        if items is not None:
+            sizes = item_sizes(items_df=items)
+        else:
+            if self._sizes is None:
+                self._sizes = item_sizes(items_df=pd.concat(self._items) if len(self._items) > 1 else self._items[0])
+            sizes = self._sizes
+        accumulate_density(grid=self.density,
+                           batches=batches,
+                           sizes=sizes,
+                           chunk_size=self.settings.get('heatmap_chunk_size'),
+                           max_workers=self.settings.get('heatmap_workers'),
+                           executor=self.settings.get('heatmap_executor', 'thread'))
+
+    def merge(self, other):
+        """
+        Args:
+            other (InsightsAccumulator): partial aggregates of other items and annotations.
+        """
+        for column, counts in other.value_counts.items():
+            self.value_counts[column].merge(counts)
+        self.annotations_per_item.merge(other.annotations_per_item)
+        self.item_sizes.merge(other.item_sizes)
+        self.annotation_sizes.merge(other.annotation_sizes)
+        if other.density is not None:
+            if self.density is None:
+                self.density = DensityGrid(resolution=other.density.resolution,
+                                           group_by=other.density.group_by,
+                                           groups=other.density.groups)
+            self.density.merge(other.density)
+        self._items.extend(other._items)
+        self._sizes = None
+
+    def serialize(self):
+        """
+        Returns:
+            dict: the serialized accumulators, name -> np.ndarray (see `utils.accumulators.serialize_all`).
+                The item sizes used to normalize the annotation locations are not kept.
+        """
+        return serialize_all(self._parts())
+
+    @classmethod
+    def from_serialized(cls, data, settings):
+        """
+        Args:
+            data (dict or np.lib.npyio.NpzFile): accumulators serialized by `serialize`.
+            settings (dict): insights settings.
+
+        Returns:
+            InsightsAccumulator
+        """
+        accumulator = cls(settings=settings)
+        for name, part in deserialize_all(data).items():
+            if name.startswith('counts.'):
+                accumulator.value_counts[name.partition('.')[2]] = part
+            else:
+                setattr(accumulator, name, part)
+        return accumulator
+
+    def result(self, snapshot=None):
+        """
+        Args:
+            snapshot (str): snapshot time of the accumulated tables.
+
+        Returns:
+            InsightsAggregates
+        """
+        if self.density is None:
+            resolution = self.settings.get('heatmap_resolution', DEFAULT_RESOLUTION)
+            density, group_densities = np.zeros((resolution, resolution), dtype=np.int64), dict()
+        else:
+            density, group_densities = self.density.result()
+        extent = self.item_sizes.extent
+        return InsightsAggregates(
+            label_counts=self.value_counts['label'].result(),
+            type_counts=self.value_counts['type'].result(),
+            annotations_per_item=self.annotations_per_item.result(),
+            item_sizes=self.item_sizes.result(),
+            annotation_sizes=_binned_sizes(sizes=self.annotation_sizes.result(),
+                                           extent=self.annotation_sizes.extent,
+                                           bins=self.settings.get('size_bins', DEFAULT_SIZE_BINS)),
+            density=density,
+            group_densities=group_densities,
+            max_item_width=float(extent[1]) if np.isfinite(extent[1]) else 0,
+            max_item_height=float(extent[3]) if np.isfinite(extent[3]) else 0,
+            snapshot=snapshot,
+        )
+
+
+class InsightsAggregates:
+    """
+    Compact statistics of the items and annotations tables, enough to render every dashboard chart.
+
+    Attributes:
+        label_counts (pd.Series): number of annotations by label, most frequent first.
+        type_counts (pd.Series): number of annotations by type, most frequent first.
+        annotations_per_item (np.ndarray): number of items by their number of annotations (index), counting
+            annotated items only.
+        item_sizes (pd.DataFrame): `width`, `height` and `count` of the distinct item sizes.
+        annotation_sizes (pd.DataFrame): `annotation_width`, `annotation_height` and `count` of annotation
+            sizes, binned on a regular grid (bin centers).
+        density (np.ndarray): annotation location density grid, see `utils.heatmap`.
+        group_densities (dict): density grids by label/type, when the heatmap is grouped.
+        max_item_width (float): widest item.
+        max_item_height (float): tallest item.
+        snapshot (str): snapshot time of the tables the aggregates were computed from.
+        approximation (dict): sample sizes and error bounds of approximate aggregates (see
+            `utils.approximate`), None for exact ones. Approximate aggregates are not saved.
+    """
+
+    def __init__(self,
+                 label_counts,
+                 type_counts,
+                 annotations_per_item,
+                 item_sizes,
+                 annotation_sizes,
+                 density,
+                 group_densities=None,
+                 max_item_width=0,
+                 max_item_height=0,
+                 snapshot=None,
+                 approximation=None):
+        self.label_counts = label_counts
+        self.type_counts = type_counts
+        self.annotations_per_item = annotations_per_item
+        self.item_sizes = item_sizes
+        self.annotation_sizes = annotation_sizes
+        self.density = density
+        self.group_densities = group_densities or dict()
+        self.max_item_width = max_item_width
+        self.max_item_height = max_item_height
+        self.snapshot = snapshot
+        self.approximation = approximation
+
+    @classmethod
+    def from_tables(cls, items_df, annotations_df, settings, snapshot=None):
+        """
+        Computes the aggregates of the items and annotations tables.
+
+        Args:
+            items_df (pd.DataFrame): items table.
+            annotations_df (pd.DataFrame): annotations table.
+            settings (dict): insights settings, for the heatmap and size binning options.
+            snapshot (str): snapshot time of the tables.
+
+        Returns:
+            InsightsAggregates
+        """
+        accumulator = InsightsAccumulator(settings=settings)
+        accumulator.update_items(items_df)
+        accumulator.update_annotations(annotations_df)
+        accumulator.update_locations(annotations_df)
+        return accumulator.result(snapshot=snapshot)
+
+    @classmethod
+    def from_handles(cls, items, annotations, settings, snapshot=None):
+        """
+        Computes the aggregates from lazy table handles, without ever loading the whole tables: each
+        pass reads only the columns it needs, and the annotations are streamed batch by batch into an
+        `InsightsAccumulator`.
+
+        Args:
+            items (InsightsTableHandle): items table.
+            annotations (InsightsTableHandle): annotations table.
+            settings (dict): insights settings, for the heatmap and size binning options.
+            snapshot (str): snapshot time of the tables.
+
+        Returns:
+            InsightsAggregates
+        """
+        accumulator = InsightsAccumulator(settings=settings)
+        accumulator.update_items(items.read(columns=['item_id', 'width', 'height']))
+        group_by = accumulator.group_by
+        count_columns = ['item_id', 'label', 'type', 'annotation_width', 'annotation_height']
+        if group_by is not None and group_by not in count_columns:
+            count_columns.append(group_by)
+        for batch in annotations.iter_batches(columns=count_columns):
+            accumulator.update_annotations(batch)
+        box_columns = ['item_id', 'left', 'top', 'right', 'bottom']
+        if group_by is not None:
+            box_columns.append(group_by)
+        accumulator.update_locations(annotations.iter_batches(columns=box_columns))
+        return accumulator.result(snapshot=snapshot)
+
+    def save(self, path):
+        """
+        Saves the aggregates as a compressed .npz file.
+
+        Args:
+            path (str): local file path.
+        """
+        group_names = list(self.group_densities)
+        np.savez_compressed(
+            path,
+            version=np.int64(AGGREGATES_VERSION),
+            snapshot=np.str_(self.snapshot or ''),
+            label_names=np.array([str(name) for name in self.label_counts.index], dtype=str),
+            label_counts=self.label_counts.to_numpy(dtype=np.int64),
+            type_names=np.array([str(name) for name in self.type_counts.index], dtype=str),
+            type_counts=self.type_counts.to_numpy(dtype=np.int64),
+            annotations_per_item=np.asarray(self.annotations_per_item, dtype=np.int64),
+            item_sizes=self.item_sizes[['width', 'height', 'count']].to_numpy(dtype=np.float64),
+            annotation_sizes=self.annotation_sizes[['annotation_width',
+                                                    'annotation_height',
+                                                    'count']].to_numpy(dtype=np.float64),
+            density=self.density,
+            group_names=np.array([str(name) for name in group_names], dtype=str),
+            group_densities=np.array([self.group_densities[name] for name in group_names], dtype=np.int64),
+            max_item_size=np.array([self.max_item_width, self.max_item_height], dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, source):
+        """
+        Loads aggregates saved by `save`.
+
+        Args:
+            source (str or file-like): .npz path or buffer.
+
+        Returns:
+            InsightsAggregates
+        """
+        with np.load(source, allow_pickle=False) as data:
+            item_sizes = data['item_sizes'].reshape(-1, 3)
+            annotation_sizes = data['annotation_sizes'].reshape(-1, 3)
+            max_item_width, max_item_height = data['max_item_size']
+            return cls(
+                label_counts=pd.Series(data['label_counts'], index=data['label_names'].tolist(), name='count'),
+                type_counts=pd.Series(data['type_counts'], index=data['type_names'].tolist(), name='count'),
+                annotations_per_item=data['annotations_per_item'],
+                item_sizes=pd.DataFrame({'width': item_sizes[:, 0],
+                                         'height': item_sizes[:, 1],
+                                         'count': item_sizes[:, 2].astype(np.int64)}),
+                annotation_sizes=pd.DataFrame({'annotation_width': annotation_sizes[:, 0],
+                                               'annotation_height': annotation_sizes[:, 1],
+                                               'count': annotation_sizes[:, 2].astype(np.int64)}),
+                density=data['density'],
+                group_densities=dict(zip(data['group_names'].tolist(), data['group_densities'])),
+                max_item_width=float(max_item_width),
+                max_item_height=float(max_item_height),
+                snapshot=str(data['snapshot']) or None,
+            )
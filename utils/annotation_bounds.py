@@ -0,0 +1,62 @@
+import math
+
+
+def _box_bounds(coordinates):
+    x1, y1 = coordinates[0]['x'], coordinates[0]['y']
+    x2, y2 = coordinates[1]['x'], coordinates[1]['y']
+    return min(y1, y2), min(x1, x2), max(y1, y2), max(x1, x2)
+
+
+def _polygon_bounds(coordinates):
+    points = coordinates[0]
+    xs = [point['x'] for point in points]
+    ys = [point['y'] for point in points]
+    return min(ys), min(xs), max(ys), max(xs)
+
+
+def _point_bounds(coordinates):
+    x, y = coordinates['x'], coordinates['y']
+    return y, x, y, x
+
+
+def _ellipse_bounds(coordinates):
+    x, y = coordinates['center']['x'], coordinates['center']['y']
+    rx, ry = coordinates['rx'], coordinates['ry']
+    rad = math.radians(coordinates['angle'])
+    cos, sin = math.cos(rad), math.sin(rad)
+    half_width = math.sqrt((rx * cos) ** 2 + (ry * sin) ** 2)
+    half_height = math.sqrt((rx * sin) ** 2 + (ry * cos) ** 2)
+    return y - half_height, x - half_width, y + half_height, x + half_width
+
+
+_BOUNDS_BY_TYPE = {
+    'box': _box_bounds,
+    'segment': _polygon_bounds,
+    'polyline': _polygon_bounds,
+    'point': _point_bounds,
+    'ellipse': _ellipse_bounds,
+}
+
+
+def annotation_bounds(annotation_json):
+    """
+    Reads the bounding coordinates of an annotation straight from its platform JSON.
+
+    Only the common geometry types (box, segment, polyline, point, ellipse) are understood, with the same
+    bounds `dl.Annotation` computes for them (box rotation is ignored, as in the SDK).
+
+    Args:
+        annotation_json (dict): annotation JSON, as found in the export's 'annotations' list.
+
+    Returns:
+        tuple: (top, left, bottom, right), or None when the annotation has to go through the SDK
+            (unknown type, or coordinates missing or malformed).
+    """
+    bounds = _BOUNDS_BY_TYPE.get(annotation_json.get('type'))
+    coordinates = annotation_json.get('coordinates')
+    if bounds is None or not coordinates:
+        return None
+    try:
+        return bounds(coordinates)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
@@ -0,0 +1,107 @@
+import logging
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from utils.aggregates import InsightsAggregates
+from utils.insights_tables import build_tables
+from utils.sketches import QuantileSketch, Reservoir
+
+logger = logging.getLogger('[INSIGHTS]')
+
+# exported items per streamed chunk
+APPROXIMATE_CHUNK_SIZE = 10000
+# z-score of the confidence intervals of the sampled counts
+CONFIDENCE_Z = 1.96
+SIZE_QUANTILES = (0.5, 0.95)
+# relative error of the size quantiles
+QUANTILE_ACCURACY = 0.01
+
+
+def _scaled_counts(counts, scale):
+    # Poisson error of the sampled counts, scaled up with them
+    return np.rint(counts * scale).astype(np.int64), CONFIDENCE_Z * np.sqrt(counts) * scale
+
+
+def approximate_aggregates(download_data, settings, sample_size, seed=None, snapshot=None):
+    """
+    Computes approximate aggregates of an export in a single streaming pass, without building its tables.
+
+    The cheap per-item and per-annotation fields are read for the whole export: labels, annotation types,
+    item sizes and annotations per item are counted exactly. The annotation geometry (sizes and location
+    heatmap) comes from a uniform reservoir sample of `sample_size` items, whose counts are scaled up to
+    the whole export, with their box sizes in quantile sketches.
+
+    Args:
+        download_data (list): exported item JSONs, with their 'annotations'.
+        settings (dict): insights settings, for the heatmap and size binning options.
+        sample_size (int): items of the reservoir sample.
+        seed (int): seed of the reservoir sample.
+        snapshot (str): version of the aggregates.
+
+    Returns:
+        InsightsAggregates: with the error bounds of the estimates in `approximation`.
+    """
+    t = time.time()
+    reservoir = Reservoir(size=sample_size, seed=seed)
+    label_counts = Counter()
+    type_counts = Counter()
+    item_ids, widths, heights, per_item = list(), list(), list(), list()
+    for start in range(0, len(download_data), APPROXIMATE_CHUNK_SIZE):
+        chunk = download_data[start:start + APPROXIMATE_CHUNK_SIZE]
+        reservoir.extend(chunk)
+        for data in chunk:
+            system = data.get('metadata', {}).get('system', {})
+            item_ids.append(data['id'])
+            widths.append(system.get('width') or 0)
+            heights.append(system.get('height') or 0)
+            annotations = data['annotations']
+            per_item.append(len(annotations))
+            label_counts.update(annotation.get('label') for annotation in annotations)
+            type_counts.update(annotation.get('type') for annotation in annotations)
+
+    sample_items_df, sample_annotations_df = build_tables(download_data=reservoir.sample)
+    sample = InsightsAggregates.from_tables(items_df=sample_items_df,
+                                            annotations_df=sample_annotations_df,
+                                            settings=settings)
+    total_annotations = int(np.sum(per_item))
+    sampled_annotations = len(sample_annotations_df)
+    scale = total_annotations / sampled_annotations if sampled_annotations else 0.0
+    size_quantiles = dict()
+    for column in ('annotation_width', 'annotation_height'):
+        sketch = QuantileSketch(relative_accuracy=QUANTILE_ACCURACY)
+        sketch.update(sample_annotations_df[column].to_numpy())
+        size_quantiles[column] = {q: sketch.quantile(q) for q in SIZE_QUANTILES}
+    annotation_sizes = sample.annotation_sizes
+    annotation_sizes['count'], annotation_sizes['error'] = _scaled_counts(annotation_sizes['count'].to_numpy(),
+                                                                         scale)
+    items_df = pd.DataFrame({'item_id': item_ids, 'width': widths, 'height': heights})
+    items_df = items_df.drop_duplicates(subset='item_id', keep='last')
+    per_item = np.asarray(per_item, dtype=np.int64)
+    per_item = per_item[per_item > 0]
+    label_counts.pop(None, None)
+    type_counts.pop(None, None)
+    aggregates = InsightsAggregates(
+        label_counts=pd.Series(label_counts, name='count', dtype=np.int64).sort_values(ascending=False, kind='stable'),
+        type_counts=pd.Series(type_counts, name='count', dtype=np.int64).sort_values(ascending=False, kind='stable'),
+        annotations_per_item=np.bincount(per_item) if per_item.size else np.zeros(1, dtype=np.int64),
+        item_sizes=items_df.groupby(['width', 'height']).size().reset_index(name='count'),
+        annotation_sizes=annotation_sizes,
+        density=_scaled_counts(sample.density, scale)[0],
+        group_densities={name: _scaled_counts(density, scale)[0] for name, density in sample.group_densities.items()},
+        max_item_width=float(items_df['width'].max()) if len(items_df) else 0,
+        max_item_height=float(items_df['height'].max()) if len(items_df) else 0,
+        snapshot=snapshot,
+        approximation={
+            'sampled_items': len(reservoir.sample),
+            'sampled_annotations': sampled_annotations,
+            'total_annotations': total_annotations,
+            'size_quantiles': size_quantiles,
+            'quantile_error': QUANTILE_ACCURACY,
+        },
+    )
+    logger.info('approximate aggregates time: %.2f[s], sampled items: %d of %d',
+                time.time() - t, len(reservoir.sample), len(download_data))
+    return aggregates
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+BINNING_MODES = ('auto', 'fixed', 'quantile', 'log')
+
+
+def bin_edges(values, weights, bins, mode='fixed'):
+    """
+    Edges of `bins` bins over weighted values.
+
+    Args:
+        values (np.ndarray): values.
+        weights (np.ndarray): count of each value.
+        bins (int): number of bins.
+        mode (str): 'fixed' for equal width bins from 0, 'quantile' for bins of equal counts, 'log' for bins of
+            equal width in log scale (values <= 0 get the first bin).
+
+    Returns:
+        np.ndarray: increasing bin edges, fewer than `bins` + 1 when quantiles repeat.
+    """
+    if mode == 'quantile':
+        order = np.argsort(values, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        ranks = np.linspace(0, cumulative[-1], bins + 1)[1:-1]
+        inner = values[order][np.minimum(np.searchsorted(cumulative, ranks), values.size - 1)]
+        edges = np.unique(np.concatenate([[values.min()], inner, [values.max()]]))
+        if edges.size == 1:
+            edges = np.array([edges[0], edges[0] + 1])
+        return edges
+    if mode == 'log':
+        positive = values[values > 0]
+        if positive.size == 0:
+            return np.array([0.0, 1.0])
+        low, high = positive.min(), max(positive.max(), positive.min() * 2)
+        return np.concatenate([[min(values.min(), 0.0)], np.geomspace(low, high, bins)])
+    return np.linspace(min(values.min(), 0), max(values.max(), 1), bins + 1)
+
+
+def _bin_index(values, edges):
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, edges.size - 2)
+
+
+def binned_points(points, x, y, bins, mode='fixed', max_points=None):
+    """
+    Bins weighted 2D points (e.g. the sizes of a height/width scatter) on a grid, halving the bins per axis
+    until at most `max_points` bins are non-empty.
+
+    Args:
+        points (pd.DataFrame): `x`, `y` and `count` columns, and optionally `error` (summed in quadrature).
+        x (str): column of the first axis.
+        y (str): column of the second axis.
+        bins (int): bins per axis.
+        mode (str): 'fixed', 'quantile' or 'log', see `bin_edges`.
+        max_points (int): most non-empty bins.
+
+    Returns:
+        pd.DataFrame: one row per non-empty bin: `x` and `y` at the weighted mean of its points, `count`,
+            `error` (when `points` has it), and the bin edges `x_low`, `x_high`, `y_low` and `y_high`.
+    """
+    xs = points[x].to_numpy(dtype=np.float64)
+    ys = points[y].to_numpy(dtype=np.float64)
+    counts = points['count'].to_numpy(dtype=np.float64)
+    errors = points['error'].to_numpy(dtype=np.float64) if 'error' in points else None
+    columns = [x, y, 'count'] + (['error'] if errors is not None else []) + ['x_low', 'x_high', 'y_low', 'y_high']
+    if xs.size == 0:
+        return pd.DataFrame({column: [] for column in columns})
+    while True:
+        x_edges = bin_edges(values=xs, weights=counts, bins=bins, mode=mode)
+        y_edges = bin_edges(values=ys, weights=counts, bins=bins, mode=mode)
+        num_y = y_edges.size - 1
+        cells = _bin_index(xs, x_edges) * num_y + _bin_index(ys, y_edges)
+        cells, inverse = np.unique(cells, return_inverse=True)
+        if max_points is None or cells.size <= max_points or bins == 1:
+            break
+        bins = max(1, bins // 2)
+    binned_counts = np.bincount(inverse, weights=counts)
+    i_x, i_y = np.divmod(cells, num_y)
+    binned = {
+        x: np.bincount(inverse, weights=xs * counts) / binned_counts,
+        y: np.bincount(inverse, weights=ys * counts) / binned_counts,
+        'count': np.rint(binned_counts).astype(np.int64),
+    }
+    if errors is not None:
+        binned['error'] = np.sqrt(np.bincount(inverse, weights=errors ** 2))
+    binned.update(x_low=x_edges[i_x], x_high=x_edges[i_x + 1], y_low=y_edges[i_y], y_high=y_edges[i_y + 1])
+    return pd.DataFrame(binned)
+
+
+def binned_histogram(counts, max_bins, tail='log'):
+    """
+    Bins a histogram of integer values (e.g. items by number of annotations) into at most `max_bins` bins,
+    leaving out the value 0.
+
+    Args:
+        counts (np.ndarray): number of occurrences of each value (index), as from `np.bincount`.
+        max_bins (int): most bins. Up to that many values, every value gets its own bin.
+        tail (str): binning of longer ranges: 'log' for bins growing geometrically, 'cap' for one bin per
+            value below the last bin, which holds all the values from there on.
+
+    Returns:
+        tuple: the first value, last value and count of each bin, as np.ndarray.
+    """
+    highest = counts.size - 1
+    if highest < 1:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    if highest <= max_bins:
+        starts = np.arange(1, highest + 1)
+    elif tail == 'cap':
+        starts = np.arange(1, max_bins + 1)
+    else:
+        starts = np.unique(np.floor(np.geomspace(1, highest + 1, max_bins + 1)[:-1]).astype(np.int64))
+    ends = np.append(starts[1:] - 1, highest)
+    return starts, ends, np.add.reduceat(counts, starts)
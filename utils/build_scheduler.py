@@ -0,0 +1,166 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.status_registry import status_registry
+
+logger = logging.getLogger('[INSIGHTS]')
+
+# state fields kept by each registry on its own
+_REGISTRY_FIELDS = ('version', 'updatedAt')
+
+# queue of the scheduler that started this build worker process, set once by `_init_build_worker`
+_worker_events = None
+
+
+def _init_build_worker(events):
+    global _worker_events
+    _worker_events = events
+
+
+def _forward_update(dataset_id, fields):
+    _worker_events.put(('status', dataset_id, fields))
+
+
+def _run_in_worker(key, fn, args, kwargs, state):
+    _worker_events.put(('started', key, None))
+    if state:
+        # start from the web process state, so the build only forwards what it changes
+        status_registry.update(key, **{name: value for name, value in state.items() if name not in _REGISTRY_FIELDS})
+    status_registry.add_listener(_forward_update)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        status_registry.remove_listener(_forward_update)
+
+
+class BuildScheduler:
+    """
+    Runs the dataset builds on a bounded pool of workers, apart from the web server threads.
+
+    Builds wait in the pool queue until a worker is free. There is at most one build in flight per dataset:
+    submitting a build for a dataset that is already queued or running attaches to that job instead of
+    starting another one. All methods are thread safe.
+
+    With the 'process' executor, builds run in spawned worker processes, so their pandas/NumPy/Plotly work
+    doesn't hold the GIL of the web server. The status registry updates of a build are forwarded to the
+    registry of this process over a queue; the build results go through the filesystem.
+
+    Attributes:
+        max_workers (int): builds running at the same time.
+        executor (str): 'thread' or 'process'.
+    """
+
+    def __init__(self, max_workers, executor='thread'):
+        self.max_workers = max_workers
+        self.executor = executor
+        self._executor = None
+        self._events = None
+        self._jobs = dict()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._attached = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _pool(self):
+        # created on first use, so that importing the module in a build worker starts nothing
+        if self._executor is None:
+            if self.executor == 'process':
+                context = multiprocessing.get_context('spawn')
+                if self._events is None:
+                    self._events = context.Queue()
+                    threading.Thread(target=self._forward_events, name='insights-build-events', daemon=True).start()
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=context,
+                                                     initializer=_init_build_worker,
+                                                     initargs=(self._events,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='insights-build')
+        return self._executor
+
+    def _forward_events(self):
+        while True:
+            kind, key, payload = self._events.get()
+            if kind == 'status':
+                status_registry.update(key, **payload)
+            elif kind == 'started':
+                with self._lock:
+                    future = self._jobs.get(key)
+                    if future is not None and not future.done():
+                        self._running.add(key)
+
+    def _run(self, key, fn, args, kwargs):
+        with self._lock:
+            self._running.add(key)
+        return fn(*args, **kwargs)
+
+    def _done(self, key, future, executor):
+        with self._lock:
+            if self._jobs.get(key) is future:
+                del self._jobs[key]
+                self._running.discard(key)
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+            if isinstance(future.exception(), BrokenProcessPool) and self._executor is executor:
+                # a worker died (e.g. out of memory), the next builds get a new pool
+                self._executor = None
+                executor.shutdown(wait=False)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('build of %s failed', key, exc_info=future.exception())
+
+    def submit(self, key, fn, *args, prepare=None, **kwargs):
+        """
+        Queues `fn(*args, **kwargs)` as the build of `key`, unless a build of `key` is already in flight.
+
+        Args:
+            key (str): dataset id of the build.
+            fn (callable): the build. With the 'process' executor, a picklable module level function.
+            prepare (callable): called before a new job is queued, and not when attaching to the job in
+                flight, e.g. to reset the published progress.
+
+        Returns:
+            tuple: the job future, and True if a new job was queued or False if it attached to the job
+                in flight.
+        """
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is not None:
+                self._attached += 1
+                return future, False
+            if prepare is not None:
+                prepare()
+            executor = self._pool()
+            if self.executor == 'process':
+                future = executor.submit(_run_in_worker, key, fn, args, kwargs, status_registry.get(key))
+            else:
+                future = executor.submit(self._run, key, fn, args, kwargs)
+            self._jobs[key] = future
+            self._submitted += 1
+        future.add_done_callback(lambda done: self._done(key, done, executor))
+        return future, True
+
+    def metrics(self):
+        """
+        Returns:
+            dict: queued and running builds, pool size, and submitted, attached, completed and failed
+                build counts.
+        """
+        with self._lock:
+            return {
+                'executor': self.executor,
+                'queued': len(self._jobs) - len(self._running),
+                'running': len(self._running),
+                'runningDatasets': sorted(self._running),
+                'maxWorkers': self.max_workers,
+                'submitted': self._submitted,
+                'attached': self._attached,
+                'completed': self._completed,
+                'failed': self._failed,
+            }
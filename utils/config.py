@@ -0,0 +1,80 @@
+import logging
+import os
+
+logger = logging.getLogger('[INSIGHTS]')
+
+ENV_PREFIX = 'INSIGHTS_'
+
+DEFAULT_SETTINGS = {
+    'theme': 'darkly',
+    # annotation location heatmap
+    'heatmap_resolution': 640,
+    'heatmap_group_by': None,  # 'label' or 'type' for per-value heatmaps
+    'heatmap_chunk_size': None,  # annotations per chunk, None for a single chunk
+    'heatmap_workers': None,
+    'heatmap_executor': 'thread',  # 'thread' or 'process'
+    'size_bins': 256,  # bins per axis of the annotation height/width scatter
+    # height/width scatters: 'auto' bins only past scatter_max_points, or always 'fixed', 'quantile' or 'log' bins
+    'scatter_binning': 'auto',
+    'scatter_bins': 128,  # bins per axis, halved until at most scatter_max_points are left
+    'scatter_max_points': 10000,
+    'scatter_webgl_points': 2000,  # scatters with as many markers render with WebGL (scattergl)
+    # annotations per item histogram: one bar per count up to histogram_max_bins, then 'log' or 'cap' bins
+    'histogram_max_bins': 100,
+    'histogram_tail': 'log',
+    'labels_top_k': 50,  # labels of the labels histogram, the others add up to an "other" bar paged through /labels
+    'figure_workers': 4,  # threads computing the dashboard figures at the same time
+    # items/annotations tables build
+    'build_workers': 1,  # processes building the tables, 1 builds in the calling thread
+    'build_chunk_size': 1000,  # exported items per worker task
+    'build_jobs': 2,  # dataset builds running at the same time, the others are queued
+    'build_executor': 'process',  # 'process' builds in worker processes, 'thread' in the web server process
+    # large datasets first get a dashboard of approximate statistics once their export is downloaded, rendered
+    # while their exact build runs
+    'approximate_min_annotations': 5000000,  # dataset annotations from which to do so, 0 never does
+    'approximate_sample_items': 20000,  # items sampled for the approximate annotation geometry charts
+    # serialized dashboard figures cache, shared by all the datasets of the process
+    'dashboard_cache_mb': 512,
+    'dashboard_cache_ttl': 3600.0,  # seconds
+    # local Arrow copies of the items/annotations tables, shared by the processes of the host
+    'table_cache_dir': 'tmp/tables',
+    'table_cache_mb': 2048,
+    # update cached tables with the items changed since their snapshot, instead of reusing them as is
+    'incremental_update': False,
+}
+
+# settings whose default is None, and so can't tell their type
+_SETTING_TYPES = {
+    'heatmap_group_by': str,
+    'heatmap_chunk_size': int,
+    'heatmap_workers': int,
+}
+
+
+def load_settings(environ=None):
+    """
+    Builds the insights settings: the defaults, overridden per deployment by `INSIGHTS_<NAME>` environment
+    variables (e.g. INSIGHTS_BUILD_WORKERS=8).
+
+    Args:
+        environ (dict): environment to read the overrides from. Defaults to `os.environ`.
+
+    Returns:
+        dict: settings by name.
+    """
+    if environ is None:
+        environ = os.environ
+    settings = dict(DEFAULT_SETTINGS)
+    for name, default in DEFAULT_SETTINGS.items():
+        value = environ.get(ENV_PREFIX + name.upper())
+        if value is None or value == '':
+            continue
+        setting_type = _SETTING_TYPES.get(name, type(default))
+        if setting_type is bool:
+            settings[name] = value.lower() in ('1', 'true', 'yes')
+            continue
+        try:
+            settings[name] = setting_type(value)
+        except ValueError:
+            logger.warning('ignoring invalid %s%s value: %r', ENV_PREFIX, name.upper(), value)
+    return settings
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class DashboardCache:
+    """
+    Process-wide cache of rendered dashboards, bounded by total size and entry age.
+
+    Entries are evicted least recently used first once `max_bytes` is exceeded, and expire `ttl` seconds
+    after they were put. All methods are thread safe.
+
+    Attributes:
+        max_bytes (int): size budget of all the entries together.
+        ttl (float): seconds an entry stays valid. None keeps entries until evicted.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key):
+        """
+        Returns:
+            the cached value of `key`, or None on a miss (absent or expired).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(created_at=entry[2], now=now):
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """
+        Caches `value` under `key`, evicting least recently used entries to stay within `max_bytes`.
+
+        A value larger than the whole budget is not cached.
+
+        Args:
+            key (hashable): cache key.
+            value: the value to cache.
+            size (int): approximate size of `value` in bytes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            for cached_key, (_, _, created_at) in list(self._entries.items()):
+                if self._expired(created_at=created_at, now=now):
+                    self._remove(cached_key)
+                    self._expirations += 1
+            if size > self.max_bytes:
+                return
+            while self._size + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+            self._entries[key] = (value, size, now)
+            self._size += size
+
+    def invalidate(self, predicate):
+        """
+        Drops the entries whose key matches `predicate`.
+
+        Args:
+            predicate (callable): called with each key, True drops the entry.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: entry count, size, hits, misses, hit ratio, evictions and expirations.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'sizeBytes': self._size,
+                'maxBytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRatio': self._hits / lookups if lookups else 0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import shutil
+
+import plotly.io as pio
+
+FIGURE_SUFFIX = '.json.gz'
+
+
+def serialize_figure(fig):
+    """
+    Serializes a Plotly figure once, to the gzip-compressed JSON the browser loads.
+
+    Args:
+        fig (go.Figure): the figure.
+
+    Returns:
+        bytes: gzip-compressed figure JSON.
+    """
+    return gzip.compress(pio.to_json(fig, validate=False).encode(), compresslevel=6)
+
+
+def serialize_json(data):
+    """
+    Serializes data saved with the figures of a dashboard, as gzip-compressed JSON like them.
+
+    Args:
+        data: JSON-serializable data.
+
+    Returns:
+        bytes: gzip-compressed JSON.
+    """
+    return gzip.compress(json.dumps(data).encode(), compresslevel=6)
+
+
+def deserialize_json(content):
+    """
+    Args:
+        content (bytes): gzip-compressed JSON, as from `serialize_json`.
+
+    Returns:
+        the data.
+    """
+    return json.loads(gzip.decompress(content))
+
+
+def _version_dir(version):
+    return version.replace('/', '_').replace(':', '_')
+
+
+class FigureStore:
+    """
+    Serialized figures of a dataset on disk, one directory per dashboard version.
+
+    Attributes:
+        root (str): directory of the dataset figures.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def save(self, version, figures):
+        """
+        Writes the serialized figures of a dashboard version, and removes the other versions.
+
+        Args:
+            version (str): dashboard version.
+            figures (dict): graph id -> serialized figure bytes.
+        """
+        for graph_id, content in figures.items():
+            self.save_figure(version=version, graph_id=graph_id, content=content)
+        for name in os.listdir(self.root):
+            if name != _version_dir(version):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def save_figure(self, version, graph_id, content):
+        """
+        Writes one serialized figure of a dashboard version, keeping the others.
+
+        Args:
+            version (str): dashboard version.
+            graph_id (str): graph id.
+            content (bytes): serialized figure.
+        """
+        path = os.path.join(self.root, _version_dir(version))
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, f'{graph_id}{FIGURE_SUFFIX}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        # readers never see a partially written figure
+        os.replace(tmp_path, os.path.join(path, f'{graph_id}{FIGURE_SUFFIX}'))
+
+    def load(self, version):
+        """
+        Reads the serialized figures of a dashboard version.
+
+        Args:
+            version (str): dashboard version.
+
+        Returns:
+            dict: graph id -> serialized figure bytes, or None if the version is not on disk.
+        """
+        path = os.path.join(self.root, _version_dir(version))
+        if not os.path.isdir(path):
+            return None
+        figures = dict()
+        for name in os.listdir(path):
+            if name.endswith(FIGURE_SUFFIX):
+                with open(os.path.join(path, name), 'rb') as f:
+                    figures[name[:-len(FIGURE_SUFFIX)]] = f.read()
+        return figures
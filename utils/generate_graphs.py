@@ -1,13 +1,66 @@
 import matplotlib.pyplot as plt
 import numpy as np
-import time
 import tqdm
 import plotly.express as px
 from dash_bootstrap_templates import load_figure_template
 
+from utils.binning import binned_histogram, binned_points
+from utils.heatmap import compact_density
+
 load_figure_template(["cyborg", "darkly", "minty", "cerulean"])
 
 
+def _title(title, note=None):
+    # approximate charts tell so, with their error bounds, under the title
+    return title if note is None else f'{title}<br><sup>{note}</sup>'
+
+
+def _scatter_points(points, x, y, settings):
+    # bins the points of a height/width scatter as configured; in 'auto' mode only when there are too many
+    mode = settings.get('scatter_binning', 'auto')
+    max_points = settings.get('scatter_max_points')
+    if mode == 'auto':
+        if max_points is None or len(points) <= max_points:
+            return points.rename(columns={'count': 'Counts'}), False
+        mode = 'fixed'
+    binned = binned_points(points=points, x=x, y=y, bins=settings.get('scatter_bins', 128), mode=mode,
+                           max_points=max_points)
+    return binned.rename(columns={'count': 'Counts'}), True
+
+
+def _bin_ranges(a, x_name, y_name):
+    return [f'<br>{x_name} {x_low:.4g}-{x_high:.4g}, {y_name} {y_low:.4g}-{y_high:.4g}'
+            for x_low, x_high, y_low, y_high in zip(a['x_low'], a['x_high'], a['y_low'], a['y_high'])]
+
+
+def _size_scatter(a, title, x, y, settings, max_x, max_y, sizemin):
+    # marker size and colour both encode the counts; many markers render with WebGL
+    fig = px.scatter(data_frame=a,
+                     title=title,
+                     x=x,
+                     y=y,
+                     size='Counts',
+                     color='Counts',
+                     hover_name='hover_text',  # Set hover text
+                     render_mode='webgl' if len(a) >= settings.get('scatter_webgl_points', 2000) else 'svg',
+                     )
+    fig.update_traces(marker=dict(sizemode='area',
+                                  sizeref=2. * max(a['Counts'], default=1) / (40. ** 2),
+                                  sizemin=sizemin))
+    if settings.get('scatter_binning', 'auto') == 'log':
+        fig.update_xaxes(type='log', title='Height')
+        fig.update_yaxes(type='log', title='Width')
+    else:
+        fig.update_xaxes(range=[0, max_x], title='Height')  # Set min x to 0 and max x to 40
+        fig.update_yaxes(range=[0, max_y], title='Width')  # Set min x to 0 and max x to 40
+    return fig
+
+
+def _sample_note(approximation):
+    return (f"approximate: {approximation['sampled_annotations']:,} annotations of a "
+            f"{approximation['sampled_items']:,} items sample, scaled to {approximation['total_annotations']:,}")
+
+
 class GraphsCalculator:
     def __init__(self):
         self._fig_histogram_annotation_by_item = None
@@ -29,12 +82,25 @@ class GraphsCalculator:
         self._fig_scatter_annotation_height_width = None
         self._fig_pie_annotation_attributes = None
 
-    def histogram_annotation_by_item(self, df, settings):
+    def histogram_annotation_by_item(self, aggregates, settings):
         if self._fig_histogram_annotation_by_item is None:
-            group_counts = df.groupby('item_id').size().reset_index(name='counts')
-            fig = px.histogram(x=group_counts.values[:, 1],
-                               title='Number of Annotations by Items',
-                               nbins=group_counts.values[:, 1].max())
+            # binned here, one bar per bin instead of one point per item or annotations count
+            starts, ends, counts = binned_histogram(counts=aggregates.annotations_per_item,
+                                                    max_bins=settings.get('histogram_max_bins', 100),
+                                                    tail=settings.get('histogram_tail', 'log'))
+            if np.array_equal(starts, ends):
+                x = starts
+            else:
+                # uneven bins, evenly spaced by their value range
+                x = [str(start) if start == end else f'{start}-{end}' for start, end in zip(starts, ends)]
+                if settings.get('histogram_tail', 'log') == 'cap':
+                    x[-1] = f'{starts[-1]}+'
+            fig = px.bar(dict(Annotations=x, Items=counts),
+                         x='Annotations',
+                         y='Items',
+                         title='Number of Annotations by Items',
+                         )
+            fig.update_layout(bargap=0)
             self._fig_histogram_annotation_by_item = fig
         else:
             fig = self._fig_histogram_annotation_by_item
@@ -45,9 +111,9 @@ class GraphsCalculator:
         # fig.show('browser')
         return fig
 
-    def pie_annotation_type(self, df, settings):  # 1, 2
+    def pie_annotation_type(self, aggregates, settings):  # 1, 2
         if self._fig_pie_annotation_type is None:
-            type_value_counts = df['type'].value_counts()
+            type_value_counts = aggregates.type_counts
 
             fig = px.pie(labels=type_value_counts.index,
                          values=type_value_counts.values,
@@ -69,13 +135,24 @@ class GraphsCalculator:
 
         return fig
 
-    def bar_annotations_labels(self, df, settings):
+    def bar_annotations_labels(self, aggregates, settings):
         if self._fig_bar_annotations_labels is None:
-            label_value_counts = df['label'].value_counts()
-            fig = px.bar(x=label_value_counts.index,
-                         y=label_value_counts.values,
+            label_value_counts = aggregates.label_counts
+            top_k = settings.get('labels_top_k', 50)
+            # customdata: label offset of the next page of counts, for the "other" bar (see /labels)
+            offsets = [None] * min(len(label_value_counts), top_k)
+            if len(label_value_counts) > top_k:
+                rest = label_value_counts.iloc[top_k:]
+                label_value_counts = label_value_counts.iloc[:top_k].copy()
+                label_value_counts[f'other ({len(rest):,} labels)'] = rest.sum()
+                offsets.append(top_k)
+            # named columns, as px.bar can't take an empty index for x (datasets without labeled annotations)
+            fig = px.bar(dict(x=label_value_counts.index.tolist(), y=label_value_counts.values),
+                         x='x',
+                         y='y',
                          title="Annotation Labels Histogram"
                          )
+            fig.update_traces(customdata=offsets)
             self._fig_bar_annotations_labels = fig
         else:
             fig = self._fig_bar_annotations_labels
@@ -83,24 +160,20 @@ class GraphsCalculator:
 
         return fig
 
-    def scatter_item_height_width(self, df, settings):
+    def scatter_item_height_width(self, aggregates, settings):
         if self._fig_scatter_item_height_width is None:
-            a = df.groupby(['width', 'height']).size().reset_index(name='Counts')
+            a, binned = _scatter_points(points=aggregates.item_sizes, x='width', y='height', settings=settings)
             a['hover_text'] = [f'Count: {count}' for count in a['Counts']]
-            fig = px.scatter(data_frame=a,
-                             title="Item Height/Width",
-                             x='height',
-                             y='width',
-                             size='Counts',
-                             hover_name='hover_text',  # Set hover text
-                             )
-            fig.update_traces(marker=dict(sizemode='area',
-                                          sizeref=2. * max(a['Counts']) / (40. ** 2),
-                                          sizemin=4))
-            fig.update_xaxes(range=[0, df['height'].max()],
-                             title='Height')  # Set min x to 0 and max x to 40
-            fig.update_yaxes(range=[0, df['width'].max()],
-                             title='Width')  # Set min x to 0 and max x to 40
+            if binned:
+                a['hover_text'] += _bin_ranges(a, x_name='width', y_name='height')
+            fig = _size_scatter(a=a,
+                                title="Item Height/Width",
+                                x='height',
+                                y='width',
+                                settings=settings,
+                                max_x=aggregates.max_item_height,
+                                max_y=aggregates.max_item_width,
+                                sizemin=4)
             self._fig_scatter_item_height_width = fig
         else:
             fig = self._fig_scatter_item_height_width
@@ -161,28 +234,23 @@ class GraphsCalculator:
 
         return fig
 
-    def heatmap_annotation_location(self, annotations_df, items_df, settings):
+    def heatmap_annotation_location(self, aggregates, settings):
         if self._fig_heatmap_annotation_location is None:
-            t = time.time()
-            density_matrix = np.zeros((640, 640))
-            size_by_item = dict()
-            for _, row in items_df.iterrows():
-                size_by_item[row.item_id] = [row.height, row.width]
-            for _, row in annotations_df.iterrows():
-                left, top, right, bottom = row.left, row.top, row.right, row.bottom
-                img_h, img_w = size_by_item[row.item_id]
-                s_l = int(640 * left / img_w)
-                s_t = int(640 * top / img_h)
-                s_r = int(640 * right / img_w)
-                s_b = int(640 * bottom / img_h)
-                density_matrix[int(s_t):int(s_b), int(s_l):int(s_r)] += 1
-            print(f'density matrix creation time: {(time.time() - t):.2f}[s]')
-            # pool.shutdown()
+            density_matrix = compact_density(aggregates.density)
+            group_matrices = {name: compact_density(matrix) for name, matrix in aggregates.group_densities.items()}
+            approximation = aggregates.approximation
             fig = px.imshow(img=density_matrix,
-                            title="Annotation Location Heatmap",
+                            title=_title("Annotation Location Heatmap",
+                                         None if approximation is None else _sample_note(approximation)),
                             color_continuous_scale='Viridis',  # Colorscale
                             labels=dict(x="Normalized Width", y="Normalized Height", color="density"),
                             )
+            if group_matrices:
+                # one dropdown entry per label/type, switching the heatmap z values
+                buttons = [dict(label='All', method='restyle', args=[{'z': [density_matrix]}])]
+                buttons += [dict(label=str(name), method='restyle', args=[{'z': [matrix]}])
+                            for name, matrix in group_matrices.items()]
+                fig.update_layout(updatemenus=[dict(buttons=buttons, x=1, y=1.15, xanchor='right')])
             # Update x and y axes to hide tick labels
             fig.update_xaxes(title_text="Normalized Width", showticklabels=False)
             fig.update_yaxes(title_text="Normalized Height", showticklabels=False)
@@ -215,22 +283,34 @@ class GraphsCalculator:
         return fig
         #
 
-    def scatter_annotation_height_width(self, df, max_item_height, max_item_width, settings):
+    def scatter_annotation_height_width(self, aggregates, settings):
         if self._fig_scatter_annotation_height_width is None:
-            a = df.groupby(['annotation_width', 'annotation_height']).size().reset_index(name='Counts')
-            a['hover_text'] = [f'Count: {count}' for count in a['Counts']]
-            fig = px.scatter(data_frame=a,
-                             title="Annotation Height/Width",
-                             x='annotation_height',
-                             y='annotation_width',
-                             size='Counts',
-                             hover_name='hover_text',  # Set hover text
-                             )
-            fig.update_traces(marker=dict(sizemode='area', sizeref=2. * max(a['Counts']) / (40. ** 2), sizemin=1))
-            fig.update_xaxes(range=[0, max_item_height],
-                             title='Height')  # Set min x to 0 and max x to 40
-            fig.update_yaxes(range=[0, max_item_width],
-                             title='Width')  # Set min x to 0 and max x to 40
+            a, binned = _scatter_points(points=aggregates.annotation_sizes,
+                                        x='annotation_width',
+                                        y='annotation_height',
+                                        settings=settings)
+            approximation = aggregates.approximation
+            note = None
+            if approximation is None:
+                a['hover_text'] = [f'Count: {count}' for count in a['Counts']]
+            else:
+                a['hover_text'] = [f'Count: ~{count} ± {error:.0f}' for count, error in zip(a['Counts'], a['error'])]
+                quantiles = approximation['size_quantiles']
+                note = '{}; median {:.0f}x{:.0f}, p95 {:.0f}x{:.0f} (±{:.0%})'.format(
+                    _sample_note(approximation),
+                    quantiles['annotation_height'][0.5], quantiles['annotation_width'][0.5],
+                    quantiles['annotation_height'][0.95], quantiles['annotation_width'][0.95],
+                    approximation['quantile_error'])
+            if binned:
+                a['hover_text'] += _bin_ranges(a, x_name='width', y_name='height')
+            fig = _size_scatter(a=a,
+                                title=_title("Annotation Height/Width", note),
+                                x='annotation_height',
+                                y='annotation_width',
+                                settings=settings,
+                                max_x=aggregates.max_item_height,
+                                max_y=aggregates.max_item_width,
+                                sizemin=1)
             self._fig_scatter_annotation_height_width = fig
         else:
             fig = self._fig_scatter_annotation_height_width
@@ -0,0 +1,309 @@
+import functools
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('[INSIGHTS]')
+
+DEFAULT_RESOLUTION = 640
+DEFAULT_MAX_GROUPS = 20
+
+# item sizes shared with the density process pool workers, set once per worker process by `_init_density_worker`.
+# Threads get the sizes of their own build passed along instead, as the builds of a process share this global.
+_worker_sizes = None
+
+
+def item_sizes(items_df):
+    """
+    Indexes the item sizes by `item_id` for the annotation -> item lookup.
+
+    Args:
+        items_df (pd.DataFrame): items with `item_id`, `width` and `height` columns.
+
+    Returns:
+        pd.DataFrame: `width` and `height` columns indexed by `item_id`.
+    """
+    return items_df.drop_duplicates(subset='item_id').set_index('item_id')[['width', 'height']]
+
+
+def normalized_boxes(annotations_df, sizes, resolution=DEFAULT_RESOLUTION):
+    """
+    Projects annotation boxes onto a `resolution` x `resolution` grid, relative to their item size.
+
+    Item sizes are joined to the annotations through an index lookup on `item_id`. Annotations whose item
+    is missing from `sizes`, or whose item has no (or zero) width/height, cannot be normalized and are
+    dropped with a warning.
+
+    Args:
+        annotations_df (pd.DataFrame): annotations with `item_id`, `left`, `top`, `right` and `bottom` columns.
+        sizes (pd.DataFrame): item sizes, as returned by `item_sizes`.
+        resolution (int): size of the target grid.
+
+    Returns:
+        tuple: (top, left, bottom, right) integer arrays clipped to [0, resolution], and the boolean mask of
+            the `annotations_df` rows they were computed from.
+    """
+    boxes = annotations_df[['item_id', 'left', 'top', 'right', 'bottom']].join(sizes, on='item_id')
+
+    img_w = boxes['width'].to_numpy(dtype=np.float64)
+    img_h = boxes['height'].to_numpy(dtype=np.float64)
+    coords = boxes[['left', 'top', 'right', 'bottom']].to_numpy(dtype=np.float64)
+    valid = (img_w > 0) & (img_h > 0) & np.isfinite(coords).all(axis=1)
+    num_skipped = int(valid.size - np.count_nonzero(valid))
+    if num_skipped:
+        logger.warning('skipping %d annotations with missing or zero item size', num_skipped)
+
+    img_w = img_w[valid]
+    img_h = img_h[valid]
+    coords = coords[valid]
+    scaled = np.empty_like(coords)
+    scaled[:, 0] = coords[:, 0] / img_w
+    scaled[:, 1] = coords[:, 1] / img_h
+    scaled[:, 2] = coords[:, 2] / img_w
+    scaled[:, 3] = coords[:, 3] / img_h
+    scaled = np.clip(np.trunc(resolution * scaled), 0, resolution).astype(np.intp)
+    left, top, right, bottom = scaled.T
+    return top, left, bottom, right, valid
+
+
+def density_from_boxes(top, left, bottom, right, resolution=DEFAULT_RESOLUTION, groups=None, num_groups=1):
+    """
+    Counts, for every grid cell, how many boxes cover it.
+
+    Uses a 2D difference array: each box adds four corner markers, and two prefix sums turn the markers into
+    the coverage counts. The cost is O(N + resolution^2) instead of O(N * box area).
+
+    Args:
+        top, left, bottom, right (np.ndarray): integer box edges in grid units, within [0, resolution].
+        resolution (int): size of the grid.
+        groups (np.ndarray): optional group code per box, in [0, num_groups). Boxes with a negative code
+            are left out.
+        num_groups (int): number of group grids to build when `groups` is given.
+
+    Returns:
+        np.ndarray: (resolution, resolution) int64 density matrix, or (num_groups, resolution, resolution)
+            when `groups` is given.
+    """
+    stride = resolution + 1
+    cells = stride * stride
+    keep = (bottom > top) & (right > left)
+    if groups is None:
+        offset = 0
+        grids = 1
+    else:
+        keep &= groups >= 0
+        offset = groups[keep] * cells
+        grids = num_groups
+    top, left, bottom, right = top[keep], left[keep], bottom[keep], right[keep]
+    added = np.concatenate([offset + top * stride + left, offset + bottom * stride + right])
+    removed = np.concatenate([offset + top * stride + right, offset + bottom * stride + left])
+    diff = np.bincount(added, minlength=grids * cells) - np.bincount(removed, minlength=grids * cells)
+    diff = diff.reshape(grids, stride, stride)
+    density = diff.cumsum(axis=1).cumsum(axis=2)[:, :resolution, :resolution]
+    return density[0] if groups is None else density
+
+
+class DensityGrid:
+    """
+    Mergeable annotation location density: the total grid, and one grid per value of `group_by` in
+    `groups`. The groups are fixed up front, so that grids accumulated from different batches or shards of
+    the annotations add up.
+
+    Attributes:
+        resolution (int): size of the grids.
+        group_by (str): annotation column of the per-value grids, None for the total grid only.
+        groups (list): values of `group_by` that get their own grid.
+        total (np.ndarray): (resolution, resolution) total density.
+        by_group (np.ndarray): (len(groups), resolution, resolution) densities, None without groups.
+    """
+
+    def __init__(self, resolution=DEFAULT_RESOLUTION, group_by=None, groups=()):
+        self.resolution = resolution
+        self.group_by = group_by
+        self.groups = list(groups) if group_by is not None else list()
+        self.total = np.zeros((resolution, resolution), dtype=np.int64)
+        self.by_group = None
+        if self.groups:
+            self.by_group = np.zeros((len(self.groups), resolution, resolution), dtype=np.int64)
+
+    def update(self, batch, sizes):
+        """
+        Adds a batch of annotation boxes.
+
+        Args:
+            batch (pd.DataFrame): annotations with `item_id`, `left`, `top`, `right` and `bottom` columns, and
+                the `group_by` column.
+            sizes (pd.DataFrame): item sizes, as returned by `item_sizes`.
+        """
+        top, left, bottom, right, valid = normalized_boxes(annotations_df=batch, sizes=sizes,
+                                                           resolution=self.resolution)
+        self.total += density_from_boxes(top=top, left=left, bottom=bottom, right=right, resolution=self.resolution)
+        if self.by_group is not None:
+            codes = pd.Index(self.groups).get_indexer(batch[self.group_by]).astype(np.intp)
+            self.by_group += density_from_boxes(top=top, left=left, bottom=bottom, right=right,
+                                                resolution=self.resolution, groups=codes[valid],
+                                                num_groups=len(self.groups))
+
+    def merge(self, other):
+        """
+        Args:
+            other (DensityGrid): grid of the same resolution and groups to add to this one.
+        """
+        if (self.resolution, self.group_by, self.groups) != (other.resolution, other.group_by, other.groups):
+            raise ValueError('density grids of different resolutions or groups can not be merged')
+        self.total += other.total
+        if self.by_group is not None:
+            self.by_group += other.by_group
+
+    def serialize(self):
+        """
+        Returns:
+            dict: name -> np.ndarray, see `utils.accumulators.deserialize`.
+        """
+        return {
+            'kind': np.str_(type(self).__name__),
+            'group_by': np.str_(self.group_by or ''),
+            'groups': np.array([str(name) for name in self.groups], dtype=str),
+            'total': self.total,
+            'by_group': self.by_group if self.by_group is not None else np.zeros((0, 0, 0), dtype=np.int64),
+        }
+
+    @classmethod
+    def from_serialized(cls, data):
+        grid = cls(resolution=data['total'].shape[0],
+                   group_by=str(data['group_by']) or None,
+                   groups=data['groups'].tolist())
+        grid.total = np.array(data['total'], dtype=np.int64)
+        if grid.by_group is not None:
+            grid.by_group = np.array(data['by_group'], dtype=np.int64)
+        return grid
+
+    def result(self):
+        """
+        Returns:
+            tuple: the total density matrix and a dict of density matrices by `group_by` value.
+        """
+        if self.by_group is None:
+            return self.total, dict()
+        return self.total, {name: self.by_group[i] for i, name in enumerate(self.groups)}
+
+
+def _init_density_worker(sizes):
+    global _worker_sizes
+    _worker_sizes = sizes
+
+
+def _chunk_density(chunk, resolution, group_by, groups, sizes=None):
+    if sizes is None:
+        sizes = _worker_sizes
+    grid = DensityGrid(resolution=resolution, group_by=group_by, groups=groups)
+    grid.update(batch=chunk, sizes=sizes)
+    return grid
+
+
+def _density_pool(sizes, max_workers, executor):
+    # the pool and the chunk task of a density pass
+    if executor == 'process':
+        # forking a process with running threads can deadlock the child on a lock held by another thread
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        pool = ProcessPoolExecutor(max_workers=max_workers,
+                                   mp_context=multiprocessing.get_context(start_method),
+                                   initializer=_init_density_worker,
+                                   initargs=(sizes,))
+        return pool, _chunk_density
+    return ThreadPoolExecutor(max_workers=max_workers), functools.partial(_chunk_density, sizes=sizes)
+
+
+def accumulate_density(grid, batches, sizes, chunk_size=None, max_workers=None, executor='thread'):
+    """
+    Adds annotations to a density grid.
+
+    With `chunk_size` set, the annotations are regrouped into chunks of `chunk_size` annotations, whatever
+    the size of the batches they come in, and each chunk accumulates a partial grid in a thread or process
+    pool that is merged into `grid`. The pool is created once for all the batches, and only when there is
+    more than one chunk.
+
+    Args:
+        grid (DensityGrid): grid to add the annotations to.
+        batches (pd.DataFrame or iterable): annotations, or batches of them, with `item_id`, `left`, `top`,
+            `right` and `bottom` columns, and the grid `group_by` column.
+        sizes (pd.DataFrame): item sizes, as returned by `item_sizes`.
+        chunk_size (int): number of annotations per chunk. None accumulates every batch in the calling thread.
+        max_workers (int): pool size when chunking. None lets the executor decide.
+        executor (str): 'thread' or 'process'.
+    """
+    if isinstance(batches, pd.DataFrame):
+        batches = [batches]
+    columns = ['item_id', 'left', 'top', 'right', 'bottom']
+    if grid.group_by is not None:
+        columns.append(grid.group_by)
+    if chunk_size is None:
+        for batch in batches:
+            grid.update(batch=batch[columns], sizes=sizes)
+        return
+
+    pool, chunk_density = None, None
+    # chunks in flight, bounded so that the batches are not all read ahead of the pool
+    pending = deque()
+    max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    num_chunks = 0
+
+    def dispatch(chunk):
+        nonlocal pool, chunk_density, num_chunks
+        if pool is None:
+            pool, chunk_density = _density_pool(sizes=sizes, max_workers=max_workers, executor=executor)
+        pending.append(pool.submit(chunk_density, chunk, grid.resolution, grid.group_by, grid.groups))
+        num_chunks += 1
+        while len(pending) > max_pending:
+            grid.merge(pending.popleft().result())
+
+    buffer = list()
+    buffered = 0
+    try:
+        for batch in batches:
+            if len(batch) == 0:
+                continue
+            buffer.append(batch[columns])
+            buffered += len(batch)
+            while buffered > chunk_size:
+                boxes = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+                dispatch(boxes.iloc[:chunk_size])
+                rest = boxes.iloc[chunk_size:]
+                buffer = [rest] if len(rest) else list()
+                buffered = len(rest)
+        if buffered:
+            rest = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+            if pool is None:
+                # a single chunk, not worth a pool
+                grid.update(batch=rest, sizes=sizes)
+            else:
+                dispatch(rest)
+        while pending:
+            grid.merge(pending.popleft().result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+            logger.info('accumulated density over %d chunks (%s pool)', num_chunks, executor)
+
+
+def compact_density(density):
+    """
+    Casts a density matrix to the smallest unsigned integer dtype that holds its values, to keep the
+    serialized heatmap small. The values are unchanged.
+
+    Args:
+        density (np.ndarray): non-negative integer density matrix.
+
+    Returns:
+        np.ndarray: the density as uint8, uint16, uint32 or (unchanged) int64.
+    """
+    peak = int(density.max()) if density.size else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if peak <= np.iinfo(dtype).max:
+            return density.astype(dtype)
+    return density
@@ -0,0 +1,109 @@
+import datetime
+import logging
+
+import dtlpy as dl
+
+from utils.insights_tables import concat_tables
+
+logger = logging.getLogger('[INSIGHTS]')
+
+# the changes window starts a bit before the stored snapshot, to absorb clock skew and items updated
+# while the snapshot was taken. Upserting an unchanged item again is harmless.
+SNAPSHOT_OVERLAP = datetime.timedelta(minutes=10)
+
+# number of item ids per `$in` query
+IDS_PER_QUERY = 500
+
+
+def utc_now():
+    """
+    Returns:
+        str: the current UTC time, in the platform's ISO format (e.g. '2024-05-01T10:20:30.123Z').
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    return now.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _changes_window_start(snapshot):
+    start = datetime.datetime.fromisoformat(snapshot.replace('Z', '+00:00')) - SNAPSHOT_OVERLAP
+    return start.astimezone(datetime.timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def fetch_updated_items(dataset: dl.Dataset, snapshot):
+    """
+    Fetches the items that changed since a snapshot, in the export format (item JSON with its annotations).
+
+    An item counts as changed when the item itself or one of its annotations was updated since `snapshot`.
+    All annotations of a changed item are fetched, so its rows can be replaced as a whole.
+
+    Args:
+        dataset (dl.Dataset): the dataset to fetch from.
+        snapshot (str): ISO time of the tables snapshot.
+
+    Returns:
+        list: exported item JSONs of the changed items.
+    """
+    since = _changes_window_start(snapshot)
+    items_json = dict()
+    filters = dl.Filters(field='updatedAt', values=since, operator=dl.FiltersOperations.GREATER_THAN)
+    for item in dataset.items.list(filters=filters).all():
+        items_json[item.id] = item.to_json()
+
+    filters = dl.Filters(resource=dl.FiltersResource.ANNOTATION,
+                         field='updatedAt',
+                         values=since,
+                         operator=dl.FiltersOperations.GREATER_THAN)
+    annotated_ids = {annotation.item_id for annotation in dataset.annotations.list(filters=filters).all()}
+    for item_ids in _chunks(annotated_ids - set(items_json), IDS_PER_QUERY):
+        filters = dl.Filters(field='id', values=item_ids, operator=dl.FiltersOperations.IN)
+        for item in dataset.items.list(filters=filters).all():
+            items_json[item.id] = item.to_json()
+
+    annotations_by_item = {item_id: list() for item_id in items_json}
+    for item_ids in _chunks(items_json, IDS_PER_QUERY):
+        filters = dl.Filters(resource=dl.FiltersResource.ANNOTATION,
+                             field='itemId',
+                             values=item_ids,
+                             operator=dl.FiltersOperations.IN)
+        for annotation in dataset.annotations.list(filters=filters).all():
+            annotations_by_item[annotation.item_id].append(annotation.to_json())
+
+    logger.info('found %d items changed since %s', len(items_json), snapshot)
+    return [dict(item_json, annotations=annotations_by_item[item_id]) for item_id, item_json in items_json.items()]
+
+
+def list_item_ids(dataset: dl.Dataset):
+    """
+    Returns:
+        set: ids of all the items currently in the dataset.
+    """
+    return {item.id for item in dataset.items.list().all()}
+
+
+def upsert_tables(items_df, annotations_df, changed_items_df, changed_annotations_df, removed_item_ids=()):
+    """
+    Replaces the rows of changed items with their new rows, and drops the rows of removed items.
+
+    Args:
+        items_df (pd.DataFrame): current items table.
+        annotations_df (pd.DataFrame): current annotations table.
+        changed_items_df (pd.DataFrame): items table of the changed items.
+        changed_annotations_df (pd.DataFrame): annotations table of the changed items.
+        removed_item_ids (iterable): ids of the items deleted from the dataset.
+
+    Returns:
+        tuple: the merged (items_df, annotations_df)
+    """
+    replaced = set(changed_items_df['item_id']) | set(removed_item_ids)
+    items_df = concat_tables([items_df[~items_df['item_id'].isin(replaced)], changed_items_df],
+                             id_column='item_id')
+    annotations_df = concat_tables([annotations_df[~annotations_df['item_id'].isin(replaced)],
+                                    changed_annotations_df],
+                                   id_column='annotation_id')
+    return items_df.reset_index(drop=True), annotations_df.reset_index(drop=True)
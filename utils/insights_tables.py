@@ -0,0 +1,391 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import dtlpy as dl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+from utils.annotation_bounds import annotation_bounds
+from utils.table_builder import ColumnarTableBuilder
+
+logger = logging.getLogger('[INSIGHTS]')
+
+METADATA_PREFIX = 'insights.'
+# version of the parquet layout, stored with the tables. Files without one were written with the pandas defaults,
+# version 2 files with float32 coordinates and annotation sizes.
+SCHEMA_VERSION = 3
+PARQUET_ROW_GROUP_SIZE = 128 * 1024
+PARQUET_COMPRESSION = 'zstd'
+# rows per batch when streaming a table
+DEFAULT_BATCH_SIZE = 65536
+
+ITEM_COLUMNS = {
+    'item_id': 'object',
+    'width': 'int64',
+    'height': 'int64',
+    'mimetype': 'category',
+    'size': 'int64',
+}
+
+ANNOTATION_COLUMNS = {
+    'item_id': 'object',
+    'type': 'category',
+    'annotation_id': 'object',
+    'label': 'category',
+    'top': 'float64',
+    'left': 'float64',
+    'bottom': 'float64',
+    'right': 'float64',
+    'annotation_height': 'float64',
+    'annotation_width': 'float64',
+    'attributes': 'object',
+}
+
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# parquet column types of the tables, narrower than their in-memory dtypes where the values allow it. Coordinates
+# stay float64, as rounding them moves box edges across heatmap bins.
+TABLE_SCHEMAS = {
+    'items': {
+        'item_id': pa.string(),
+        'width': pa.int32(),
+        'height': pa.int32(),
+        'mimetype': _CATEGORY,
+        'size': pa.int64(),
+    },
+    'annotations': {
+        'item_id': pa.string(),
+        'type': _CATEGORY,
+        'annotation_id': pa.string(),
+        'label': _CATEGORY,
+        'top': pa.float64(),
+        'left': pa.float64(),
+        'bottom': pa.float64(),
+        'right': pa.float64(),
+        'annotation_height': pa.float64(),
+        'annotation_width': pa.float64(),
+    },
+}
+
+
+class InsightsTablesBuilder:
+    """
+    Streams exported item JSONs (with their annotations) into the items and annotations tables.
+
+    Attributes:
+        items (ColumnarTableBuilder): one row per item.
+        annotations (ColumnarTableBuilder): one row per annotation.
+    """
+
+    def __init__(self):
+        self.items = ColumnarTableBuilder(columns=ITEM_COLUMNS)
+        self.annotations = ColumnarTableBuilder(columns=ANNOTATION_COLUMNS)
+
+    def add(self, data):
+        """
+        Adds one exported item and its annotations.
+
+        Bounds of the common geometry types are read straight from the annotation JSON; only the
+        annotations `annotation_bounds` does not understand are built into `dl.Annotation` objects.
+
+        Args:
+            data (dict): item JSON from the export, with an 'annotations' list.
+        """
+        item_id = data['id']
+        try:
+            system = data.get('metadata', {}).get('system', {})
+            self.items.append(
+                item_id,
+                system.get('width') or 0,
+                system.get('height') or 0,
+                system.get('mimetype', ''),
+                system.get('size') or 0,
+            )
+            fallback = list()
+            for annotation_json in data['annotations']:
+                bounds = annotation_bounds(annotation_json)
+                if bounds is None:
+                    fallback.append(annotation_json)
+                    continue
+                top, left, bottom, right = bounds
+                try:
+                    self.annotations.append(
+                        item_id,
+                        annotation_json['type'],
+                        annotation_json['id'],
+                        annotation_json.get('label'),
+                        top,
+                        left,
+                        bottom,
+                        right,
+                        bottom - top,
+                        right - left,
+                        None,
+                    )
+                except (KeyError, TypeError, ValueError):
+                    logger.exception('failed in annotation: %s', annotation_json.get('id'))
+            if fallback:
+                self._add_sdk_annotations(item_id=item_id, annotations_json=fallback)
+        except (KeyError, TypeError, ValueError):
+            logger.exception('failed in item: %s', item_id)
+
+    def _add_sdk_annotations(self, item_id, annotations_json):
+        collection = dl.AnnotationCollection.from_json(annotations_json)
+        for annotation in collection:
+            annotation: dl.Annotation
+            try:
+                self.annotations.append(
+                    item_id,
+                    annotation.type,
+                    annotation.id,
+                    annotation.label,
+                    annotation.top,
+                    annotation.left,
+                    annotation.bottom,
+                    annotation.right,
+                    annotation.bottom - annotation.top,
+                    annotation.right - annotation.left,
+                    None,
+                )
+            except (KeyError, TypeError, ValueError):
+                logger.exception('failed in annotation: %s', annotation.id)
+
+    def to_dataframes(self):
+        """
+        Emits the accumulated tables. Rows repeating an item or annotation id keep the last occurrence.
+
+        Returns:
+            tuple: (items_df, annotations_df)
+        """
+        items_df = _drop_duplicate_ids(self.items.to_dataframe(), id_column='item_id')
+        annotations_df = _drop_duplicate_ids(self.annotations.to_dataframe(), id_column='annotation_id')
+        return items_df, annotations_df
+
+
+def _drop_duplicate_ids(df, id_column):
+    duplicated = df.duplicated(subset=id_column, keep='last')
+    if not duplicated.any():
+        return df
+    df = df[~duplicated].reset_index(drop=True)
+    for column in df.select_dtypes(include='category').columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
+def build_tables_shard(shard):
+    """
+    Builds the partial items and annotations tables of a slice of the export. Runs in the build workers.
+
+    Args:
+        shard (list): exported item JSONs.
+
+    Returns:
+        tuple: (items_df, annotations_df)
+    """
+    builder = InsightsTablesBuilder()
+    for data in shard:
+        builder.add(data)
+    return builder.to_dataframes()
+
+
+def concat_tables(frames, id_column):
+    """
+    Concatenates partial tables, keeping their categorical columns categorical.
+
+    Args:
+        frames (list): partial DataFrames with the same columns.
+        id_column (str): row id column, duplicates across partials keep the last occurrence.
+
+    Returns:
+        pd.DataFrame: the concatenated table.
+    """
+    # empty partials (e.g. shards without annotations) add no rows, and their categories have no dtype
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    for column in frames[0].select_dtypes(include='category').columns:
+        df[column] = union_categoricals([_string_categories(frame[column]) for frame in frames])
+    return _drop_duplicate_ids(df, id_column=id_column)
+
+
+def _string_categories(series):
+    # categories of all-missing columns have no values to infer their dtype from, the others are strings
+    series = series.astype('category')
+    return series.cat.set_categories(series.cat.categories.astype(str))
+
+
+def _apply_schema(table, schema):
+    for i_field, field in enumerate(table.schema):
+        target = schema.get(field.name)
+        if target is None or field.type == target:
+            continue
+        column = table.column(i_field)
+        if pa.types.is_dictionary(target):
+            if not pa.types.is_dictionary(field.type):
+                column = column.cast(pa.string()).dictionary_encode()
+            column = column.cast(target)
+        else:
+            # integers must fit
+            column = column.cast(target)
+        table = table.set_column(i_field, field.name, column)
+    return table
+
+
+def write_insights_table(df, path, metadata=None, table_name=None):
+    """
+    Writes an insights table to parquet, with optional `insights.*` key-value metadata.
+
+    With `table_name`, the table is written in the insights layout: sorted by `item_id`, with the column
+    types of `TABLE_SCHEMAS` (dictionary-encoded categories, 32 bit item sizes), row groups of
+    `PARQUET_ROW_GROUP_SIZE` rows, and `SCHEMA_VERSION` in its metadata.
+
+    Args:
+        df (pd.DataFrame): the table.
+        path (str): local parquet path.
+        metadata (dict): str -> str metadata, stored under 'insights.<key>'.
+        table_name (str): 'items' or 'annotations'.
+    """
+    metadata = dict(metadata or {})
+    if table_name is not None:
+        df = df.sort_values('item_id', kind='stable')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if table_name is not None:
+        table = _apply_schema(table=table, schema=TABLE_SCHEMAS[table_name])
+        metadata['schema_version'] = SCHEMA_VERSION
+    if metadata:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata.update({f'{METADATA_PREFIX}{key}'.encode(): str(value).encode()
+                                for key, value in metadata.items()})
+        table = table.replace_schema_metadata(schema_metadata)
+    pq.write_table(table, path, row_group_size=PARQUET_ROW_GROUP_SIZE, compression=PARQUET_COMPRESSION)
+
+
+def read_insights_table(source):
+    """
+    Reads an insights table written by `write_insights_table` (or a plain parquet file).
+
+    Columns keep their stored types, so tables in the insights layout load with their compact dtypes,
+    and older files (without a schema version) load as they were written.
+
+    Args:
+        source (str or file-like): parquet path or buffer.
+
+    Returns:
+        tuple: (df, metadata), metadata being the `insights.*` key-value metadata without the prefix.
+    """
+    table = pq.read_table(source)
+    metadata = _insights_metadata(table.schema)
+    if int(metadata.get('schema_version', 1)) > SCHEMA_VERSION:
+        logger.warning('reading an insights table of a newer schema version: %s', metadata['schema_version'])
+    return table.to_pandas(), metadata
+
+
+def _insights_metadata(schema):
+    metadata = dict()
+    for key, value in (schema.metadata or {}).items():
+        key = key.decode()
+        if key.startswith(METADATA_PREFIX):
+            metadata[key[len(METADATA_PREFIX):]] = value.decode()
+    return metadata
+
+
+class InsightsTableHandle:
+    """
+    Lazy handle of an insights table file on local disk (parquet, or Arrow IPC from the local table cache).
+
+    Nothing is read until asked for, and reads are projected to the requested columns.
+
+    Attributes:
+        path (str): table file path.
+        metadata (dict): the `insights.*` key-value metadata without the prefix.
+    """
+
+    def __init__(self, path, file_format='parquet'):
+        self.path = path
+        self._dataset = ds.dataset(path, format=file_format)
+        self.metadata = _insights_metadata(self._dataset.schema)
+
+    @property
+    def columns(self):
+        return self._dataset.schema.names
+
+    def read(self, columns):
+        """
+        Reads some columns of the table.
+
+        Args:
+            columns (list): column names.
+
+        Returns:
+            pd.DataFrame
+        """
+        return self._dataset.to_table(columns=columns).to_pandas()
+
+    def iter_batches(self, columns, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Streams some columns of the table, `batch_size` rows at a time.
+
+        Args:
+            columns (list): column names.
+            batch_size (int): most rows per batch.
+
+        Yields:
+            pd.DataFrame
+        """
+        for batch in self._dataset.to_batches(columns=columns, batch_size=batch_size):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+
+def build_tables(download_data, max_workers=1, chunk_size=1000, progress_callback=None):
+    """
+    Builds the items and annotations tables of an export.
+
+    With `max_workers` > 1 the export is split into shards of `chunk_size` items, each shard is built into
+    partial tables in a process pool and the parent concatenates them. The workers are started from a
+    forkserver (or spawned), not forked from the calling process, which runs the server threads, and receive
+    their shard pickled.
+
+    Args:
+        download_data (list): exported item JSONs.
+        max_workers (int): number of build processes. 1 builds in the calling thread.
+        chunk_size (int): number of exported items per shard.
+        progress_callback (callable): called with the number of items processed so far, from all shards.
+
+    Returns:
+        tuple: (items_df, annotations_df)
+    """
+    if max_workers <= 1 or len(download_data) <= chunk_size:
+        builder = InsightsTablesBuilder()
+        for i_data, data in enumerate(download_data):
+            builder.add(data)
+            if progress_callback is not None:
+                progress_callback(i_data + 1)
+        return builder.to_dataframes()
+
+    ranges = [(start, min(start + chunk_size, len(download_data)))
+              for start in range(0, len(download_data), chunk_size)]
+    logger.info('building tables in %d shards over %d processes', len(ranges), max_workers)
+    items_parts = [None] * len(ranges)
+    annotations_parts = [None] * len(ranges)
+    processed = 0
+    # forking a process with running threads can deadlock the child on a lock held by another thread
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+        futures = {pool.submit(build_tables_shard, download_data[start:stop]): i_shard
+                   for i_shard, (start, stop) in enumerate(ranges)}
+        for future in as_completed(futures):
+            i_shard = futures[future]
+            # keep the export order, so that duplicated ids resolve as in a serial build
+            items_parts[i_shard], annotations_parts[i_shard] = future.result()
+            start, stop = ranges[i_shard]
+            processed += stop - start
+            if progress_callback is not None:
+                progress_callback(processed)
+    return (concat_tables(items_parts, id_column='item_id'),
+            concat_tables(annotations_parts, id_column='annotation_id'))
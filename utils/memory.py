@@ -0,0 +1,14 @@
+import resource
+import sys
+
+
+def peak_rss_mb():
+    """
+    Returns:
+        float: peak resident set size of the current process, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+    return peak / 1024
@@ -0,0 +1,125 @@
+import math
+import random
+
+import numpy as np
+
+
+def _open_uniform(rng):
+    # uniform in (0, 1), so its log is finite
+    value = rng.random()
+    while value == 0.0:
+        value = rng.random()
+    return value
+
+
+class Reservoir:
+    """
+    Uniform random sample of `size` elements of a stream of unknown length, in one pass (Algorithm L).
+
+    Once the reservoir is full, the number of elements to skip before the next replacement is drawn at
+    random, so adding a chunk of the stream costs one draw per replacement rather than one per element.
+
+    Attributes:
+        size (int): sample size.
+        sample (list): the sampled elements.
+        seen (int): elements of the stream added so far.
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.sample = list()
+        self.seen = 0
+        self._rng = random.Random(seed)
+        self._w = None
+        self._next = None
+
+    def _skip(self):
+        self._w *= math.exp(math.log(_open_uniform(self._rng)) / self.size)
+        if self._w >= 1.0:
+            return 1
+        return int(math.log(_open_uniform(self._rng)) / math.log(1.0 - self._w)) + 1
+
+    def extend(self, elements):
+        """
+        Adds the next chunk of the stream.
+
+        Args:
+            elements (list): stream elements, in order.
+        """
+        start = 0
+        if len(self.sample) < self.size:
+            start = min(self.size - len(self.sample), len(elements))
+            self.sample.extend(elements[:start])
+            if len(self.sample) == self.size and self.size > 0:
+                self._w = 1.0
+                self._next = self.seen + start + self._skip() - 1
+        if self._next is not None:
+            end = self.seen + len(elements)
+            while self._next < end:
+                self.sample[self._rng.randrange(self.size)] = elements[self._next - self.seen]
+                self._next += self._skip()
+        self.seen += len(elements)
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles of a stream of non-negative values, within `relative_accuracy` of the true
+    values (DDSketch). Values are counted in logarithmic buckets, so sketches of the same accuracy are
+    merged by adding their bucket counts.
+
+    Attributes:
+        relative_accuracy (float): relative error of the quantiles.
+        count (int): values counted.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets = dict()
+        self._zero_count = 0
+        self.count = 0
+
+    def update(self, values):
+        """
+        Args:
+            values (np.ndarray): values, non-finite ones are ignored and negative ones counted as 0.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        positive = values[values > 0]
+        self._zero_count += values.size - positive.size
+        self.count += values.size
+        buckets, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64), return_counts=True)
+        for bucket, count in zip(buckets.tolist(), counts.tolist()):
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+
+    def quantile(self, q):
+        """
+        Args:
+            q (float): quantile, between 0 and 1.
+
+        Returns:
+            float: the estimated quantile, NaN if no value was counted.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self._zero_count:
+            return 0.0
+        buckets = sorted(self._buckets)
+        cumulative = self._zero_count + np.cumsum([self._buckets[bucket] for bucket in buckets])
+        bucket = buckets[min(int(np.searchsorted(cumulative, rank, side='right')), len(buckets) - 1)]
+        return 2.0 * self._gamma ** bucket / (self._gamma + 1.0)
+
+    def merge(self, other):
+        """
+        Args:
+            other (QuantileSketch): sketch of the same accuracy to merge into this one.
+        """
+        if self.relative_accuracy != other.relative_accuracy:
+            raise ValueError('quantile sketches of different accuracies can not be merged')
+        for bucket, count in other._buckets.items():
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+        self._zero_count += other._zero_count
+        self.count += other.count
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class StatusRegistry:
+    """
+    In-memory export/build state of every dataset, updated by the build pipeline and read by the status
+    endpoints, so that polling a status never touches an exporter or the platform.
+
+    Each dataset state is a dict of fields plus a `version` counter, bumped on every update, that long-poll
+    clients pass back to wait for the next change. Updates can come from any thread; waiting is asyncio.
+    Listeners get every update as it is applied, e.g. to forward it to another process.
+    """
+
+    def __init__(self):
+        self._states = dict()
+        self._waiters = dict()
+        self._listeners = list()
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """
+        Args:
+            listener (callable): called with the dataset id and the updated fields of every update.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def update(self, dataset_id, **fields):
+        """
+        Merges `fields` into the dataset state and wakes up its waiters.
+
+        Args:
+            dataset_id (str): dataset id.
+            fields: state fields to set.
+        """
+        with self._lock:
+            state = self._states.setdefault(dataset_id, {'version': 0})
+            state.update(fields)
+            state['version'] += 1
+            state['updatedAt'] = time.time()
+            waiters = self._waiters.pop(dataset_id, set())
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(dataset_id, fields)
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # the waiting loop is closed, nobody is waiting anymore
+                pass
+
+    def get(self, dataset_id):
+        """
+        Returns:
+            dict: a copy of the dataset state, or None if nothing was published for it.
+        """
+        with self._lock:
+            state = self._states.get(dataset_id)
+            return None if state is None else dict(state)
+
+    async def wait(self, dataset_id, since=None, timeout=30):
+        """
+        Waits until the dataset state version differs from `since`, or `timeout` seconds pass.
+
+        Args:
+            dataset_id (str): dataset id.
+            since (int): last state version the client saw. None returns right away.
+            timeout (float): seconds to wait at most.
+
+        Returns:
+            dict: a copy of the dataset state, or None if nothing was published for it.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._states.get(dataset_id)
+            if since is None or (state is not None and state['version'] != since):
+                return None if state is None else dict(state)
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.setdefault(dataset_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.get(dataset_id, set()).discard(waiter)
+        return self.get(dataset_id)
+
+
+# process-wide registry of the datasets served by this process
+status_registry = StatusRegistry()
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+INITIAL_CAPACITY = 1024
+
+
+class ColumnarTableBuilder:
+    """
+    Accumulates rows straight into typed, preallocated column buffers and emits them as one DataFrame.
+
+    Numeric columns are NumPy buffers that double in size when full, 'category' columns store int32 codes
+    against a growing category table, and 'object' columns hold references only. No per-row Python dict
+    is created, so the peak memory stays close to the final DataFrame.
+
+    Attributes:
+        columns (dict): column name -> kind, one of 'int64', 'float64', 'category' or 'object'.
+    """
+
+    def __init__(self, columns, capacity=INITIAL_CAPACITY):
+        self.columns = dict(columns)
+        self._names = list(self.columns)
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        self._buffers = list()
+        self._categories = list()
+        for kind in self.columns.values():
+            if kind == 'category':
+                self._buffers.append(np.empty(self._capacity, dtype=np.int32))
+                self._categories.append(dict())
+            elif kind in ('int64', 'float64', 'object'):
+                self._buffers.append(np.empty(self._capacity, dtype=kind))
+                self._categories.append(None)
+            else:
+                raise ValueError(f'unsupported column kind: {kind}')
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        self._capacity *= 2
+        for i, buffer in enumerate(self._buffers):
+            grown = np.empty(self._capacity, dtype=buffer.dtype)
+            grown[:self._size] = buffer[:self._size]
+            self._buffers[i] = grown
+
+    def append(self, *values):
+        """
+        Appends one row, given in column order.
+
+        The row is only committed once every value was written, so a value that fails to convert
+        (TypeError/ValueError) leaves the table unchanged.
+        """
+        if self._size == self._capacity:
+            self._grow()
+        row = self._size
+        codes = list()
+        for buffer, categories, value in zip(self._buffers, self._categories, values):
+            if categories is not None:
+                if value is None:
+                    # missing values are stored as the -1 (NaN) code
+                    codes.append((buffer, categories, value, -1))
+                else:
+                    # new categories are only registered with the row, below
+                    codes.append((buffer, categories, value, categories.get(value)))
+            else:
+                buffer[row] = value
+        for buffer, categories, value, code in codes:
+            if code is None:
+                code = categories.setdefault(value, len(categories))
+            buffer[row] = code
+        self._size += 1
+
+    def to_dataframe(self):
+        """
+        Returns:
+            pd.DataFrame: the accumulated rows, with 'category' columns as pandas Categoricals.
+        """
+        data = dict()
+        for name, buffer, categories in zip(self._names, self._buffers, self._categories):
+            values = buffer[:self._size]
+            if categories is not None:
+                data[name] = pd.Categorical.from_codes(values, categories=list(categories))
+            else:
+                data[name] = values
+        return pd.DataFrame(data, columns=self._names)
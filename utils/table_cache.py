@@ -0,0 +1,137 @@
+import logging
+import os
+import shutil
+import uuid
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger('[INSIGHTS]')
+
+TABLE_SUFFIX = '.arrow'
+_TMP_PREFIX = '.tmp-'
+
+
+class LocalTableCache:
+    """
+    Local on-disk cache of the insights tables, one directory per dataset and tables version, holding each
+    table as an uncompressed Arrow IPC (Feather v2) file.
+
+    Loads memory-map the files, so numeric columns are used in place instead of being read and decoded.
+    The remote parquet files stay the durable copy; the cache saves their download and decoding after
+    restarts. Once the cache is larger than `max_bytes`, the least recently loaded versions are removed.
+
+    The directory can be shared by several processes (web server and build workers): recency is kept in
+    the version directory mtime, and versions are written under a temporary name, then renamed in place.
+
+    Attributes:
+        root (str): cache directory.
+        max_bytes (int): size budget of all the cached tables together.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _path(self, dataset_id, version):
+        return os.path.join(self.root, dataset_id, version.replace('/', '_').replace(':', '_'))
+
+    @staticmethod
+    def _remove(path):
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            # drop the dataset directory with its last version
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def get(self, dataset_id, version):
+        """
+        Loads the tables of a dataset version, memory-mapped.
+
+        Args:
+            dataset_id (str): dataset id.
+            version (str): tables version.
+
+        Returns:
+            dict: table name -> pd.DataFrame, or None if the version is not cached.
+        """
+        path = self._path(dataset_id=dataset_id, version=version)
+        tables = dict()
+        try:
+            for name in os.listdir(path):
+                if name.endswith(TABLE_SUFFIX):
+                    table = feather.read_table(os.path.join(path, name), memory_map=True)
+                    tables[name[:-len(TABLE_SUFFIX)]] = table.to_pandas(split_blocks=True)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, pa.ArrowException):
+            logger.warning('dropping unreadable cached tables %s', path, exc_info=True)
+            self._remove(path)
+            return None
+        return tables or None
+
+    def put(self, dataset_id, version, tables):
+        """
+        Caches the tables of a dataset version, replacing the other versions of the dataset, and evicts
+        the least recently loaded versions to stay within `max_bytes`. Tables larger than the whole
+        budget are not cached.
+
+        Args:
+            dataset_id (str): dataset id.
+            version (str): tables version.
+            tables (dict): table name -> pd.DataFrame.
+        """
+        dataset_dir = os.path.join(self.root, dataset_id)
+        path = self._path(dataset_id=dataset_id, version=version)
+        tmp_path = os.path.join(dataset_dir, f'{_TMP_PREFIX}{uuid.uuid4().hex}')
+        try:
+            os.makedirs(tmp_path)
+            size = 0
+            for name, df in tables.items():
+                table_path = os.path.join(tmp_path, f'{name}{TABLE_SUFFIX}')
+                feather.write_feather(pa.Table.from_pandas(df, preserve_index=False),
+                                      table_path,
+                                      compression='uncompressed')
+                size += os.path.getsize(table_path)
+            if size > self.max_bytes:
+                logger.info('tables of %s are larger than the table cache, not caching them', dataset_id)
+                return
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        except (OSError, pa.ArrowException):
+            logger.warning('failed to cache the tables of %s', dataset_id, exc_info=True)
+            return
+        finally:
+            if os.path.exists(tmp_path):
+                self._remove(tmp_path)
+        for name in os.listdir(dataset_dir):
+            if not name.startswith(_TMP_PREFIX) and name != os.path.basename(path):
+                shutil.rmtree(os.path.join(dataset_dir, name), ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently loaded versions until the cache is within `max_bytes`.
+        """
+        entries = list()
+        for dataset_id in os.listdir(self.root):
+            dataset_dir = os.path.join(self.root, dataset_id)
+            try:
+                for name in os.listdir(dataset_dir):
+                    if name.startswith(_TMP_PREFIX):
+                        continue
+                    path = os.path.join(dataset_dir, name)
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                    entries.append((os.stat(path).st_mtime, size, path))
+            except FileNotFoundError:
+                # removed by another process meanwhile
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.info('evicting cached tables %s', path)
+            self._remove(path)
+            total -= size